@@ -0,0 +1,254 @@
+"""
+Moves articles older than a hot window out of the primary CSVs into compressed, month-partitioned archive files.
+
+Usage: python archive.py [--hot-days 30] [--dry-run]
+
+Whole days of articles added before the hot window are moved: their rows in articles.csv (text, summary and opinion)
+and their chunk and summary embedding rows. They are appended as zstd frames to database/archive/<YYYY-MM>/<file>.zst,
+and database/archive/index.csv records the UUID, URL, day and partition of every archived article. Duplicate checks
+still see archived URLs through the index, and load_archived_article()/load_archived_embedding_rows() read a single
+partition on demand, e.g. when a new article is a near-duplicate of an archived one. Fingerprints stay in
+database/fingerprints.csv, so near-duplicates of archived articles are still found.
+
+Archived embedding rows keep the versions they had when they were archived: reembed.py only re-embeds the articles in
+articles.csv, so after a switch of embedding model the archive holds no vectors of the new version. A near-duplicate of
+an archived article is then embedded afresh rather than copied. The primary CSVs are rewritten, so run it while neither
+the scraper nor reembed.py is running.
+"""
+import argparse
+import csv
+import io
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import zstandard
+
+from article_store import ARTICLES_FILE, ARTICLES_HEADER, ensure_articles_header
+from embedding_store import (ARTICLE_EMBEDDINGS_FILE, SUMMARY_EMBEDDINGS_FILE, EMBEDDINGS_HEADER, ensure_version_column, row_version,
+                             version_filenames)
+
+ARCHIVE_DIR = "database/archive"
+ARCHIVE_INDEX_FILE = "database/archive/index.csv"
+
+ARCHIVE_INDEX_HEADER = ["article_uuid", "url", "day", "partition"]
+
+HOT_DAYS = 30  # Days of articles kept in the primary CSVs
+ZSTD_LEVEL = 10  # Archives are written once and rarely read, so favour size over speed
+
+
+def partition_for_day(day: str) -> str:
+    return day[:7]  # One partition per month, e.g. "2023-04"
+
+
+def partition_file(partition: str, name: str, archive_dir: str = ARCHIVE_DIR) -> str:
+    return os.path.join(archive_dir, partition, os.path.basename(name) + ".zst")
+
+
+def compress_rows(header: List[str], rows: Iterable[Dict]) -> bytes:
+    """Returns the rows as one zstd frame of header-less CSV, in the column order of header"""
+    text = io.StringIO()
+    writer = csv.writer(text)
+    for row in rows:
+        writer.writerow([row.get(column) for column in header])
+    return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(text.getvalue().encode("utf-8"))
+
+
+def read_partition(partition: str, name: str, header: List[str], archive_dir: str = ARCHIVE_DIR) -> Iterator[Dict]:
+    """Yields the rows archived from the file called name into a partition"""
+    path = partition_file(partition, name, archive_dir)
+    if not os.path.exists(path):
+        return
+    with open(path, "rb") as f:
+        # Each archiving run appends a frame, so read across all of them
+        reader = zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True)
+        for values in csv.reader(io.TextIOWrapper(reader, encoding="utf-8", newline="")):
+            yield dict(zip(header, values))
+
+
+class ArchiveIndex:
+    """The UUID, URL, day and partition of every archived article"""
+
+    def __init__(self, index_file: str = ARCHIVE_INDEX_FILE):
+        self.index_file = index_file
+        self.partitions: Dict[str, str] = {}
+        self.urls = set()
+
+    @classmethod
+    def load(cls, index_file: str = ARCHIVE_INDEX_FILE) -> "ArchiveIndex":
+        index = cls(index_file)
+        if os.path.exists(index_file):
+            with open(index_file, "r", newline="") as f:
+                for row in csv.DictReader(f):
+                    index.partitions[row["article_uuid"]] = row["partition"]
+                    index.urls.add(row["url"])
+        return index
+
+    def add(self, entries: List[Dict]):
+        """Records archived articles, as dicts with the ARCHIVE_INDEX_HEADER keys"""
+        os.makedirs(os.path.dirname(self.index_file), exist_ok=True)
+        with open(self.index_file, "a", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=ARCHIVE_INDEX_HEADER)
+            if f.tell() == 0:
+                writer.writeheader()
+            writer.writerows(entries)
+        for entry in entries:
+            self.partitions[entry["article_uuid"]] = entry["partition"]
+            self.urls.add(entry["url"])
+
+
+def load_archived_article(article_uuid, index: Optional[ArchiveIndex] = None) -> Optional[dict]:
+    """Returns the row of an archived article, or None if it isn't archived"""
+    index = index or ArchiveIndex.load()
+    partition = index.partitions.get(str(article_uuid))
+    if partition is None:
+        return None
+    for row in read_partition(partition, ARTICLES_FILE, ARTICLES_HEADER):
+        if row["UUID"] == str(article_uuid):
+            return row
+    return None
+
+
+def load_archived_embedding_rows(article_uuids, embeddings_file: str, version: str, index: Optional[ArchiveIndex] = None) -> dict:
+    """Returns the archived embedding rows of one version for the given articles, as {article_uuid: [row, ...]}"""
+    index = index or ArchiveIndex.load()
+    partitions = {index.partitions[article_uuid] for article_uuid in article_uuids if article_uuid in index.partitions}
+    rows = {}
+    seen = set()  # Rows archived from both an embeddings CSV and its version's own file (see embedding_store.read_rows)
+    for partition in sorted(partitions):
+        for row in read_partition(partition, embeddings_file, EMBEDDINGS_HEADER):
+            key = (row["article_uuid"], row["embedding_uuid"])
+            if row["article_uuid"] in article_uuids and row_version(row) == version and key not in seen:
+                seen.add(key)
+                rows.setdefault(row["article_uuid"], []).append(row)
+    return rows
+
+
+def scan_seconds(paths: Iterable[str]) -> float:
+    """Returns how long a full scan of the CSVs takes, as the duplicate check, date lookup and renderer do"""
+    start = time.perf_counter()
+    for path in paths:
+        with open(path, "r", newline="") as f:
+            for _ in csv.DictReader(f):
+                pass
+    return time.perf_counter() - start
+
+
+def format_size(n_bytes: int) -> str:
+    return f"{n_bytes / 1024 / 1024:.1f} MB"
+
+
+def archive_old_articles(hot_days: int = HOT_DAYS, dry_run: bool = False, archive_dir: str = ARCHIVE_DIR) -> dict:
+    """Moves whole days of articles added more than hot_days ago into the archive, and returns what was reclaimed.
+
+    Rows are appended to the archive and the index before the primary CSVs are replaced, so an interrupted run loses
+    nothing; articles that are already in the index are only removed from the primary CSVs, not archived twice.
+    """
+    cutoff = (datetime.now() - timedelta(days=hot_days)).strftime("%Y-%m-%d")
+    ensure_articles_header(ARTICLES_FILE)
+    embeddings_files = [ARTICLE_EMBEDDINGS_FILE, SUMMARY_EMBEDDINGS_FILE]
+    for embeddings_file in embeddings_files:
+        ensure_version_column(embeddings_file)
+    # Rows that reembed.py wrote to a version's own file are archived with the rows of the file they belong to
+    sources = {path: embeddings_file for embeddings_file in embeddings_files
+               for path in [embeddings_file] + version_filenames(embeddings_file)}
+    primary_files = [ARTICLES_FILE] + list(sources)
+    index = ArchiveIndex.load(os.path.join(archive_dir, "index.csv"))
+
+    # Split the articles into hot and cold by the day they were added; rows with unreadable dates stay hot
+    cold_articles = {}
+    with open(ARTICLES_FILE, "r", newline="") as f, open(ARTICLES_FILE + ".tmp", "w", newline="") as hot:
+        writer = csv.DictWriter(hot, fieldnames=ARTICLES_HEADER)
+        writer.writeheader()
+        for row in csv.DictReader(f):
+            try:
+                day = datetime.strptime(row["date_added"], "%Y-%m-%d %H:%M:%S").strftime("%Y-%m-%d")
+            except (ValueError, TypeError):
+                day = None
+            if day is not None and day < cutoff:
+                cold_articles[row["UUID"]] = (day, row)
+            else:
+                writer.writerow(row)
+
+    cold_rows = {ARTICLES_FILE: {}}
+    for article_uuid, (day, row) in cold_articles.items():
+        cold_rows[ARTICLES_FILE].setdefault(partition_for_day(day), []).append(row)
+    for path, embeddings_file in sources.items():
+        cold_rows.setdefault(embeddings_file, {})
+        with open(path, "r", newline="") as f, open(path + ".tmp", "w", newline="") as hot:
+            writer = csv.DictWriter(hot, fieldnames=EMBEDDINGS_HEADER)
+            writer.writeheader()
+            for row in csv.DictReader(f):
+                if row["article_uuid"] in cold_articles:
+                    day = cold_articles[row["article_uuid"]][0]
+                    cold_rows[embeddings_file].setdefault(partition_for_day(day), []).append(row)
+                else:
+                    writer.writerow(row)
+
+    report = {
+        "cutoff": cutoff,
+        "articles": len(cold_articles),
+        "days": len({day for day, _ in cold_articles.values()}),
+        "partitions": sorted(cold_rows[ARTICLES_FILE]),
+        "files": {},
+        "archive_bytes": 0,
+        "scan_seconds_before": scan_seconds(primary_files),
+        "scan_seconds_after": scan_seconds(path + ".tmp" for path in primary_files),
+    }
+    for path in primary_files:
+        report["files"][path] = (os.path.getsize(path), os.path.getsize(path + ".tmp"))
+
+    # Compress each file's rows per partition, skipping articles an interrupted run already archived
+    frames = []
+    for name, partitions in cold_rows.items():
+        header = ARTICLES_HEADER if name == ARTICLES_FILE else EMBEDDINGS_HEADER
+        key = "UUID" if name == ARTICLES_FILE else "article_uuid"
+        for partition, rows in partitions.items():
+            rows = [row for row in rows if row[key] not in index.partitions]
+            if rows:
+                frame = compress_rows(header, rows)
+                report["archive_bytes"] += len(frame)
+                frames.append((partition_file(partition, name, archive_dir), frame))
+
+    if dry_run:
+        for path in primary_files:
+            os.remove(path + ".tmp")
+        return report
+
+    for path, frame in frames:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "ab") as f:
+            f.write(frame)
+            f.flush()
+            os.fsync(f.fileno())
+    index.add([{"article_uuid": article_uuid, "url": row["url"], "day": day, "partition": partition_for_day(day)}
+               for article_uuid, (day, row) in cold_articles.items() if article_uuid not in index.partitions])
+    for path in primary_files:
+        os.replace(path + ".tmp", path)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move articles older than the hot window into the compressed archive")
+    parser.add_argument("--hot-days", type=int, default=HOT_DAYS, help="Days of articles to keep in the primary CSVs")
+    parser.add_argument("--dry-run", action="store_true", help="Report what would be archived without changing anything")
+    args = parser.parse_args()
+
+    print(f"Archiving articles added more than {args.hot_days} days ago{' (dry run)' if args.dry_run else ''}")
+    report = archive_old_articles(hot_days=args.hot_days, dry_run=args.dry_run)
+    if not report["articles"]:
+        print(f"  ⏭ No articles were added before {report['cutoff']}")
+        return
+
+    print(f"  • {report['articles']} articles from {report['days']} days into {len(report['partitions'])} partitions ({', '.join(report['partitions'])})")
+    reclaimed = 0
+    for path, (before, after) in report["files"].items():
+        reclaimed += before - after
+        print(f"  ✓ {os.path.basename(path)}: {format_size(before)} → {format_size(after)}")
+    print(f"  ✓ Reclaimed {format_size(reclaimed)} for {format_size(report['archive_bytes'])} of compressed archive")
+    print(f"  ✓ Scanning the primary CSVs takes {report['scan_seconds_after'] * 1000:.0f} ms instead of {report['scan_seconds_before'] * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
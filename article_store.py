@@ -0,0 +1,29 @@
+import csv
+import os
+
+ARTICLES_FILE = "database/articles.csv"
+
+ARTICLES_HEADER = ["UUID", "url", "title", "publication_date", "date_added", "category", "source", "text", "summary", "opinion"]
+
+# The header articles.csv shipped with before it named the date_added and category columns
+LEGACY_ARTICLES_HEADER = ["UUID", "url", "title", "publication_date", "source", "text", "summary", "opinion"]
+
+
+def ensure_articles_header(articles_file: str = ARTICLES_FILE):
+    """Rewrites the header of an articles CSV that still has the legacy header. The scraper always wrote all ten
+    columns, so only the header changes; without this, readers look up date_added and text in the wrong columns."""
+    if not os.path.exists(articles_file) or os.path.getsize(articles_file) == 0:
+        return
+
+    with open(articles_file, "r", newline="") as f:
+        header = next(csv.reader(f), [])
+    if header != LEGACY_ARTICLES_HEADER:
+        return
+
+    with open(articles_file, "r", newline="") as f, open(articles_file + ".tmp", "w", newline="") as out:
+        reader = csv.reader(f)
+        next(reader)
+        writer = csv.writer(out)
+        writer.writerow(ARTICLES_HEADER)
+        writer.writerows(reader)
+    os.replace(articles_file + ".tmp", articles_file)
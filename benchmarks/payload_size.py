@@ -0,0 +1,159 @@
+"""
+Compares the embeddings payload inlined in a briefing page, before and after packing the vectors: its size, and the
+time from the first question to the related sections.
+
+Usage: python benchmarks/payload_size.py [--chunks 400] [--dims 1536] [--questions 5]
+
+The old format was the Python repr of the CSV rows, with each embedding as a stringified list. The new format is the
+JSON index built by build_embeddings_index(). If node is installed, each payload is also run headlessly through the
+search code of its page (OLD_SEARCH_JS, copied from the page before the change, or scripts.js): evaluating the payload,
+decoding the embeddings and finding the top 5 sections for the first question, then for each later question. The query
+embedding request and the chat completion are left out, as they take the same time in both. In the browser the page
+logs the same steps to the console ("Decoded ... embeddings", "Found related sections", "Answered in").
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from renderer import build_embeddings_index  # noqa: E402
+
+SCRIPTS_FILE = os.path.join(os.path.dirname(__file__), "..", "scripts.js")
+
+# The page's search code before the embeddings were packed
+OLD_SEARCH_JS = """
+function pythonListToJSONArray(pythonListString) {
+  const jsonString = pythonListString.replace(/'/g, `"`).replace(/None/g, "null").replace(/True/g, "true").replace(/False/g, "false");
+  return JSON.parse(jsonString);
+}
+function dotProduct(a, b) {
+  let sum = 0;
+  for (let i = 0; i < a.length; i++) {
+    sum += a[i] * b[i];
+  }
+  return sum;
+}
+function magnitude(a) {
+  return Math.sqrt(dotProduct(a, a));
+}
+function cosineSimilarity(a, b) {
+  return dotProduct(a, b) / (magnitude(a) * magnitude(b));
+}
+async function getEmbeddings() {
+  return embeddingsData.map((row) => ({article_uuid: row.article_uuid, embedding_uuid: row.embedding_uuid, text: row.text, embedding: pythonListToJSONArray(row.embedding)}));
+}
+function getTopNResults(embeddings, searchTermVector, n) {
+  embeddings.forEach((row) => { row.similarity = cosineSimilarity(row.embedding, searchTermVector); });
+  embeddings.sort((a, b) => b.similarity - a.similarity);
+  return embeddings.slice(0, n).map((row) => row.text);
+}
+"""
+
+# Evaluates the payload the way the page's inline script does, then times the first and later searches
+NODE_HARNESS = """
+const fs = require("fs");
+const [searchFile, payloadFile, variable, dims, questions] = process.argv.slice(2);
+globalThis.document = { addEventListener() {} };
+globalThis.atob = (base64) => Buffer.from(base64, "base64").toString("binary");
+console.log = () => {};
+(0, eval)(fs.readFileSync(searchFile, "utf8"));
+const payload = fs.readFileSync(payloadFile, "utf8");
+const query = Array.from({ length: Number(dims) }, (_, i) => Math.sin(i));
+
+(async () => {
+  const start = performance.now();
+  globalThis[variable] = (0, eval)("(" + payload + ")");
+  const embeddings = await getEmbeddings();
+  getTopNResults(embeddings, query, 5);
+  const first = performance.now() - start;
+
+  const later = [];
+  for (let i = 1; i < Number(questions); i++) {
+    const searchStart = performance.now();
+    getTopNResults(embeddings, query, 5);
+    later.push(performance.now() - searchStart);
+  }
+  process.stdout.write(JSON.stringify({ first, later: later.length ? later.reduce((a, b) => a + b) / later.length : 0 }));
+})();
+"""
+
+
+def time_first_answer(search_js: str, payload: str, variable: str, dims: int, questions: int):
+    """Returns the milliseconds to the first question's sections and to each later question's, or None without node"""
+    node = shutil.which("node")
+    if node is None:
+        return None
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = {}
+        for name, content in (("search.js", search_js), ("payload.txt", payload), ("harness.js", NODE_HARNESS)):
+            paths[name] = os.path.join(tmp, name)
+            with open(paths[name], "w") as f:
+                f.write(content)
+        output = subprocess.run([node, paths["harness.js"], paths["search.js"], paths["payload.txt"], variable, str(dims), str(questions)],
+                                check=True, capture_output=True, text=True).stdout
+    timings = json.loads(output)
+    return timings["first"], timings["later"]
+
+
+def format_timings(timings) -> str:
+    if timings is None:
+        return f"{'n/a (no node)':>26}"
+    return f"{timings[0]:>11.1f} ms{timings[1]:>11.1f} ms"
+
+
+def synthetic_rows(n_chunks, dims, words_per_chunk=100):
+    rng = np.random.default_rng(0)
+    rows = []
+    for i in range(n_chunks):
+        embedding = rng.normal(size=dims)
+        embedding = embedding / np.linalg.norm(embedding)
+        rows.append({
+            "article_uuid": f"article-{i // 10}",
+            "embedding_uuid": f"article-{i // 10}_embedding-{i % 10}",
+            "text": " ".join(["word"] * words_per_chunk),
+            "embedding": str(embedding.tolist()),  # As written to article_embeddings.csv
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=400, help="Number of chunks in the day's briefing")
+    parser.add_argument("--dims", type=int, default=1536, help="Embedding dimensions")
+    parser.add_argument("--questions", type=int, default=5, help="Questions asked, for the time of later searches")
+    args = parser.parse_args()
+
+    rows = synthetic_rows(args.chunks, args.dims)
+    with open(SCRIPTS_FILE, "r") as f:
+        scripts = f.read()
+
+    start = time.perf_counter()
+    old_payload = str(rows)
+    old_seconds = time.perf_counter() - start
+    print(f"{'format':<24}{'payload':>14}{'build':>12}{'first answer':>16}{'later':>13}")
+    old_timings = time_first_answer(OLD_SEARCH_JS, old_payload, "embeddingsData", args.dims, args.questions)
+    print(f"{'repr (before)':<24}{len(old_payload):>12,} B{old_seconds * 1000:>9.1f} ms{format_timings(old_timings)}")
+
+    for dtype in ("float32", "float16"):
+        start = time.perf_counter()
+        payload = json.dumps(build_embeddings_index(rows, dtype=dtype))
+        seconds = time.perf_counter() - start
+        timings = time_first_answer(scripts, payload, "embeddingsIndex", args.dims, args.questions)
+        print(f"{'inline ' + dtype:<24}{len(payload):>12,} B{seconds * 1000:>9.1f} ms{format_timings(timings)}")
+
+        with tempfile.TemporaryDirectory() as tmp:
+            vectors_file = os.path.join(tmp, "embeddings.bin")
+            payload = json.dumps(build_embeddings_index(rows, dtype=dtype, vectors_file=vectors_file))
+            sidecar = os.path.getsize(vectors_file)
+        print(f"{'sidecar ' + dtype:<24}{len(payload):>12,} B   (+ {sidecar:,} B loaded on the first question)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,379 @@
+"""
+Offline end-to-end benchmark of the briefing pipeline.
+
+Usage: python benchmarks/pipeline.py [--sizes 10 100 1000] [--repeat 3] [--latency 0] [--rate-limit 0] [--profiles 0] [--update-baselines]
+
+For each size it builds a synthetic day of that many articles from the recorded page fixtures in benchmarks/fixtures,
+and runs it through the real pipeline in a temporary copy of the database: get_articles, scrape_money_stuff (and so
+extract_text_from_newsletter_soup), save_new_articles, save_embeddings and BriefingRenderer. The Economist and
+newsletterhunt are replayed from the fixtures and OpenAI is replaced by the stub server in stub_openai.py, so no
+credentials are needed. It is not fully offline on a fresh machine: NLTK's stopwords and punkt data must be downloaded
+(see helpers.py), and tiktoken downloads the cl100k_base encoding on first use and caches it, so run it once with a
+network connection or point TIKTOKEN_CACHE_DIR at a directory that holds the encoding. --profiles N also renders
+a personalised page for each of N synthetic reader profiles (see profiles.py), to show what each extra profile costs.
+
+Each size is run --repeat times, and it reports the median throughput and stage times, and the latency of each API
+call. Results are compared with benchmarks/baselines.json, and any stage more than --tolerance slower per article than
+its baseline is reported as a regression (exit code 1). Stages with a fixed cost per run (the one newsletter, and the
+profiles' interest vectors) aren't checked, as their cost per article is mostly noise. No baselines are shipped, as
+timings only compare on the same machine: --update-baselines saves this run's results as the baselines.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))  # Before anything imports the stdlib secrets module
+
+import argparse  # noqa: E402
+import contextlib  # noqa: E402
+import functools  # noqa: E402
+import html  # noqa: E402
+import io  # noqa: E402
+import json  # noqa: E402
+import random  # noqa: E402
+import shutil  # noqa: E402
+import statistics  # noqa: E402
+import tempfile  # noqa: E402
+import time  # noqa: E402
+from datetime import datetime, timedelta  # noqa: E402
+from string import Template  # noqa: E402
+
+import openai  # noqa: E402
+import tiktoken  # noqa: E402
+from bs4 import BeautifulSoup  # noqa: E402
+
+import money_stuff  # noqa: E402
+import scraper  # noqa: E402
+from embeddings import Embeddings  # noqa: E402
+from profiles import InterestVectorCache, MAX_ARTICLES  # noqa: E402
+from renderer import BriefingRenderer  # noqa: E402
+from the_economist import get_articles  # noqa: E402
+from stub_openai import start_stub_server  # noqa: E402
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+BASELINES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+
+ECONOMIST_URL = "https://www.economist.com"
+NEWSLETTER_URL = "https://newsletterhunt.com"
+
+SECTIONS = ["finance-and-economics", "business", "international", "science-and-technology", "europe", "asia", "culture"]
+VOCABULARY = (
+    "bank banks rates inflation central market markets bond bonds yield investors growth economy government policy "
+    "election minister president parliament reform tax taxes budget deficit debt trade tariffs exports imports china "
+    "america europe india japan russia ukraine war peace army climate energy oil gas power carbon emissions solar wind "
+    "technology chips software artificial intelligence firms company companies profits shares stocks prices wages jobs "
+    "workers unions housing mortgages credit lending deposits regulators regulation court judges law rights voters "
+    "polls party coalition opposition protest cities farmers food water drought health hospitals vaccine disease "
+    "research scientists data models study evidence schools students universities teachers history culture film "
+    "music art books sport football cricket crisis recovery recession forecast outlook risk risks stability"
+).split()
+
+
+class FixtureResponse:
+    def __init__(self, text: str):
+        self.text = text
+        self.content = text.encode("utf-8")
+        self.status_code = 200
+
+
+class FixtureSession:
+    """Answers GET requests from a dictionary of recorded pages, in place of requests.Session"""
+
+    def __init__(self, pages: dict):
+        self.pages = pages
+
+    def get(self, url, *args, **kwargs) -> FixtureResponse:
+        return FixtureResponse(self.pages[url])
+
+
+def read_fixture(name: str) -> Template:
+    with open(os.path.join(FIXTURES_DIR, name), "r") as f:
+        return Template(f.read())
+
+
+def synthetic_text(rng: random.Random, n_paragraphs: int, words_per_paragraph: int) -> list:
+    paragraphs = []
+    for _ in range(n_paragraphs):
+        words = [rng.choice(VOCABULARY) for _ in range(words_per_paragraph)]
+        paragraphs.append(" ".join(words).capitalize() + ".")
+    return paragraphs
+
+
+def synthetic_day(n_articles: int, seed: int = 0, duplicates: float = 0.0) -> dict:
+    """Returns {url: page} for a homepage linking n_articles - 1 Economist articles, plus one Money Stuff newsletter.
+
+    A fraction of the articles, given by duplicates, are earlier articles republished under a new URL with an extra line.
+    """
+    rng = random.Random(seed)
+    published = datetime(2023, 4, 26, 6, 0, 0)
+    pages = {}
+    links = []
+    article_paragraphs = []
+
+    article_template = read_fixture("economist_article.html")
+    for i in range(n_articles - 1):
+        section = SECTIONS[i % len(SECTIONS)]
+        title = " ".join(rng.choice(VOCABULARY) for _ in range(6)).capitalize()
+        href = f"/{section}/2023/04/26/article-{i}"
+        links.append(f'            <a data-analytics="{section}:article_{i}" href="{href}">{html.escape(title)}</a>')
+
+        date = published + timedelta(minutes=i)
+        if i > 0 and rng.random() < duplicates:
+            paragraphs = article_paragraphs[rng.randrange(i)] + ["This article has been updated."]
+        else:
+            paragraphs = synthetic_text(rng, n_paragraphs=rng.randint(6, 12), words_per_paragraph=rng.randint(60, 110))
+        article_paragraphs.append(paragraphs)
+        pages[ECONOMIST_URL + href] = article_template.substitute(
+            title=html.escape(title),
+            subtitle=html.escape(" ".join(rng.choice(VOCABULARY) for _ in range(10)).capitalize()),
+            section=section,
+            datetime=date.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            formatted_date=date.strftime("%b %d %Y"),
+            paragraphs="\n".join(f"                <p>{paragraph}</p>" for paragraph in paragraphs),
+        )
+
+    pages[ECONOMIST_URL] = read_fixture("economist_homepage.html").substitute(links="\n".join(links))
+
+    # Money Stuff, with the newsletter itself in the srcdoc of an iframe
+    newsletter_href = "/newsletters/money-stuff-by-matt-levine/issues/banks-and-bonds"
+    newsletter_title = "Money Stuff: Banks and bonds"
+    sections = []
+    for heading in ("Banks and bonds", "Private credit", "Things happen"):
+        paragraphs = synthetic_text(rng, n_paragraphs=5, words_per_paragraph=120)
+        sections.append(f"<h2>{heading}</h2>\n" + "\n".join(f"<p>{paragraph}</p>" for paragraph in paragraphs))
+    srcdoc = "<html><body>\n" + "\n".join(sections) + "\n<p>Follow Us</p><p>Unsubscribe</p></body></html>"
+
+    pages[NEWSLETTER_URL + "/newsletters/money-stuff-by-matt-levine"] = read_fixture("newsletter_list.html").substitute(
+        links=f'            <li><a href="{newsletter_href}">{newsletter_title}</a></li>')
+    pages[NEWSLETTER_URL + newsletter_href] = read_fixture("newsletter.html").substitute(
+        title=newsletter_title,
+        datetime=published.strftime("%Y-%m-%dT%H:%M:%S+00:00"),
+        formatted_date=published.strftime("%d %B %Y"),
+        srcdoc=html.escape(srcdoc, quote=True),
+    )
+
+    return pages
+
+
+class StageTimer:
+    """Records the duration of each pipeline stage, and of each call to the functions it wraps"""
+
+    def __init__(self):
+        self.stages = {}
+        self.calls = {}
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def wrap(self, name: str, function):
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.calls.setdefault(name, []).append(time.perf_counter() - start)
+        return timed
+
+
+@contextlib.contextmanager
+def patched(target, name: str, value):
+    original = getattr(target, name)
+    setattr(target, name, value)
+    try:
+        yield
+    finally:
+        setattr(target, name, original)
+
+
+@contextlib.contextmanager
+def workspace():
+    """Runs the pipeline in a temporary copy of the repo's files, with an empty database"""
+    previous_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.makedirs(os.path.join(tmp, "database"))
+        os.makedirs(os.path.join(tmp, "briefings"))
+        for name in ("styles.css", "scripts.js"):
+            shutil.copy(os.path.join(REPO_DIR, name), tmp)
+        with open(os.path.join(REPO_DIR, "database", "articles.csv"), "r") as f:
+            header = f.readline()
+        with open(os.path.join(tmp, "database", "articles.csv"), "w") as f:
+            f.write(header)
+        for name in ("article_embeddings.csv", "summary_embeddings.csv"):
+            open(os.path.join(tmp, "database", name), "w").close()
+
+        os.chdir(tmp)
+        try:
+            yield tmp
+        finally:
+            os.chdir(previous_dir)
+
+
+def synthetic_profiles(n_profiles: int) -> list:
+    topics = ["central banks and interest rates", "artificial intelligence", "elections", "climate policy", "trade"]
+    return [{"name": f"reader-{i}", "interests": f"{topics[i % len(topics)]} ({i})", "sources": [], "categories": [],
+             "max_articles": MAX_ARTICLES} for i in range(n_profiles)]
+
+
+def run_day(n_articles: int, server, duplicates: float = 0.0, n_profiles: int = 0, verbose: bool = False) -> dict:
+    pages = synthetic_day(n_articles, duplicates=duplicates)
+    session = FixtureSession(pages)
+    timer = StageTimer()
+    output = sys.stdout if verbose else io.StringIO()
+    server.stats.clear()
+
+    with workspace(), contextlib.redirect_stdout(output), \
+            patched(money_stuff, "requests", session), \
+            patched(scraper, "summarise_article", timer.wrap("summarise_article", scraper.summarise_article)), \
+            patched(scraper, "summarise_section", timer.wrap("summarise_section", scraper.summarise_section)), \
+            patched(scraper, "categorise_article", timer.wrap("categorise_article", scraper.categorise_article)), \
+            patched(scraper, "preprocess_text", timer.wrap("preprocess_text", scraper.preprocess_text)):
+        start = time.perf_counter()
+        articles = {}
+
+        with timer.stage("scrape"):
+            soup = BeautifulSoup(session.get(ECONOMIST_URL).text, "html.parser")
+            articles.update(get_articles(soup, session, ECONOMIST_URL))
+        with timer.stage("newsletter"):
+            articles.update(money_stuff.scrape_money_stuff())
+        with timer.stage("summarise"):
+            new_articles = scraper.save_new_articles(articles)
+        with timer.stage("embed"):
+            embedder = Embeddings()
+            embedder.get_embedding = timer.wrap("get_embedding", embedder.get_embedding)
+            scraper.save_embeddings(new_articles, embedder)
+        profiles = synthetic_profiles(n_profiles)
+        interest_vectors = {}
+        if profiles:
+            with timer.stage("interests"):
+                interest_vectors = InterestVectorCache().interest_vectors(profiles, embedder)
+        with timer.stage("render"):
+            rendered_days = BriefingRenderer().render_changed_days(profiles=profiles, interest_vectors=interest_vectors)
+
+        total = time.perf_counter() - start
+
+    return {
+        "articles": len(new_articles),
+        "days_rendered": len(rendered_days),
+        "seconds": total,
+        "articles_per_second": len(new_articles) / total if total else 0.0,
+        "stages": timer.stages,
+        "calls": {name: summarise_latencies(latencies) for name, latencies in timer.calls.items()},
+        "api": {endpoint: dict(stats) for endpoint, stats in server.stats.items()},
+    }
+
+
+def median_result(results: list) -> dict:
+    """Returns the last of several runs of the same day, with the median total and stage times of all of them"""
+    result = dict(results[-1])
+    result["seconds"] = statistics.median(r["seconds"] for r in results)
+    result["articles_per_second"] = result["articles"] / result["seconds"] if result["seconds"] else 0.0
+    result["stages"] = {stage: statistics.median(r["stages"][stage] for r in results) for stage in result["stages"]}
+    return result
+
+
+def summarise_latencies(latencies: list) -> dict:
+    latencies = sorted(latencies)
+    return {
+        "count": len(latencies),
+        "p50": statistics.median(latencies),
+        "p95": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+        "total": sum(latencies),
+    }
+
+
+def print_report(n_articles: int, result: dict):
+    print(f"{n_articles} articles: {result['articles']} saved in {result['seconds']:.2f} s "
+          f"({result['articles_per_second']:.1f} articles/s)")
+    print(f"  {'stage':<24}{'total':>10}{'per article':>14}")
+    for stage, seconds in result["stages"].items():
+        print(f"  {stage:<24}{seconds:>8.2f} s{seconds / max(result['articles'], 1) * 1000:>11.1f} ms")
+    print(f"  {'call':<24}{'count':>10}{'p50':>14}{'p95':>12}")
+    for name, stats in result["calls"].items():
+        print(f"  {name:<24}{stats['count']:>10}{stats['p50'] * 1000:>11.1f} ms{stats['p95'] * 1000:>9.1f} ms")
+    for endpoint, stats in result["api"].items():
+        print(f"  {endpoint}: {stats['requests']} requests, {stats['rate_limited']} rate limited, "
+              f"{stats['inputs']} inputs, {stats['tokens']} tokens")
+
+
+# Stages whose cost doesn't grow with the number of articles: one newsletter per run, one interest vector per profile
+FIXED_COST_STAGES = {"newsletter", "interests"}
+
+
+def compare_with_baseline(n_articles: int, result: dict, baselines: dict, tolerance: float) -> list:
+    """Returns a message for each stage that is slower per article than its baseline by more than the tolerance"""
+    baseline = baselines.get(str(n_articles))
+    if baseline is None:
+        return []
+
+    regressions = []
+    for stage, seconds in result["stages"].items():
+        baseline_seconds = baseline["stages"].get(stage)
+        if not baseline_seconds or stage in FIXED_COST_STAGES:
+            continue
+        per_article = seconds / max(result["articles"], 1)
+        baseline_per_article = baseline_seconds / max(baseline["articles"], 1)
+        if per_article > baseline_per_article * (1 + tolerance):
+            regressions.append(f"{n_articles} articles, {stage}: {per_article * 1000:.1f} ms per article, "
+                               f"baseline {baseline_per_article * 1000:.1f} ms (+{per_article / baseline_per_article - 1:.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000], help="Articles in each synthetic day")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds the stub API adds to every request")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="Fraction of stub API requests answered with a 429")
+    parser.add_argument("--duplicates", type=float, default=0.0, help="Fraction of articles that are republished near-duplicates")
+    parser.add_argument("--profiles", type=int, default=0, help="Synthetic reader profiles to render a page for")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs of each size; stage times are the median of the runs")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown per article before a stage is a regression")
+    parser.add_argument("--update-baselines", action="store_true", help="Save this run as the new baselines")
+    parser.add_argument("--verbose", action="store_true", help="Show the pipeline's own output")
+    args = parser.parse_args()
+
+    try:
+        tiktoken.get_encoding("cl100k_base")  # Load the encoding before anything is timed
+    except Exception as e:
+        sys.exit(f"✗ Could not load tiktoken's cl100k_base encoding ({e}). Run once online or set TIKTOKEN_CACHE_DIR.")
+    server = start_stub_server(latency=args.latency, rate_limit=args.rate_limit)
+    openai.api_base = server.base_url
+    openai.api_key = "stub"
+
+    try:
+        with open(BASELINES_FILE, "r") as f:
+            baselines = json.load(f)
+    except FileNotFoundError:
+        baselines = {}
+
+    regressions = []
+    for n_articles in args.sizes:
+        result = median_result([run_day(n_articles, server, duplicates=args.duplicates, n_profiles=args.profiles, verbose=args.verbose)
+                                for _ in range(max(args.repeat, 1))])
+        print_report(n_articles, result)
+        print()
+        regressions += compare_with_baseline(n_articles, result, baselines, args.tolerance)
+        if args.update_baselines:
+            baselines[str(n_articles)] = {"articles": result["articles"], "seconds": result["seconds"], "stages": result["stages"]}
+
+    server.shutdown()
+
+    if args.update_baselines:
+        with open(BASELINES_FILE, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        print(f"Saved baselines to {BASELINES_FILE}")
+
+    if regressions and not args.update_baselines:
+        print("Regressions:")
+        for regression in regressions:
+            print(f"  ✗ {regression}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
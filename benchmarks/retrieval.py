@@ -0,0 +1,106 @@
+"""
+Latency and recall of two-stage (article, then chunk) retrieval against searching every chunk, as history grows.
+
+Usage: python benchmarks/retrieval.py [--days 7 30 90 180] [--articles-per-day 30] [--top-articles 5 10 20 50]
+
+It builds a synthetic history of briefings: articles on a hundred shared topics, each with --chunks-per-article
+chunk vectors and a summary vector scattered around the article's own direction. Questions are noisy copies of random
+chunks. For each history length it times VectorIndex.search over every chunk, and with top_articles=M ranking the
+articles first by their summary embedding or by the centroid of their chunks. Recall@k is the fraction of the
+exhaustive top k that the two-stage search also returns.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from embeddings import VectorIndex  # noqa: E402
+
+
+def random_directions(rng, n, dims):
+    vectors = rng.normal(size=(n, dims))
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def synthetic_history(n_days, articles_per_day, chunks_per_article, dims, n_topics=100, seed=0):
+    """Returns the chunk rows, summary rows and chunk vectors of n_days of briefings, oldest first"""
+    rng = np.random.default_rng(seed)
+    topics = random_directions(rng, n_topics, dims)
+    n_articles = n_days * articles_per_day
+
+    # Articles lean towards a topic, and their chunks and summary towards the article
+    centres = topics[rng.integers(n_topics, size=n_articles)] + 0.6 * random_directions(rng, n_articles, dims)
+    centres /= np.linalg.norm(centres, axis=1, keepdims=True)
+    chunks = np.repeat(centres, chunks_per_article, axis=0) + 1.6 * random_directions(rng, n_articles * chunks_per_article, dims)
+    summaries = centres + 0.5 * random_directions(rng, n_articles, dims)
+
+    rows, summary_rows = [], []
+    for article in range(n_articles):
+        article_uuid = f"article-{article}"
+        for i in range(chunks_per_article):
+            vector = chunks[article * chunks_per_article + i]
+            rows.append({"article_uuid": article_uuid, "embedding_uuid": f"{article_uuid}_embedding-{i}", "text": "",
+                         "embedding": json.dumps(np.round(vector, 5).tolist())})
+        summary_rows.append({"article_uuid": article_uuid, "embedding_uuid": f"{article_uuid}_embedding-summary", "text": "",
+                             "embedding": json.dumps(np.round(summaries[article], 5).tolist())})
+    return rows, summary_rows, chunks
+
+
+def time_searches(index, queries, k, top_articles=None):
+    latencies, results = [], []
+    for query in queries:
+        start = time.perf_counter()
+        results.append({row for row, _ in index.search(query, k, top_articles=top_articles)})
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return statistics.median(latencies), latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--days", type=int, nargs="+", default=[7, 30, 90, 180], help="Days of history to search")
+    parser.add_argument("--articles-per-day", type=int, default=30)
+    parser.add_argument("--chunks-per-article", type=int, default=12)
+    parser.add_argument("--dims", type=int, default=256, help="Embedding dimensions (1536 for ada-002, slower to build)")
+    parser.add_argument("--top-articles", type=int, nargs="+", default=[5, 10, 20, 50], help="Values of M to compare")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=5, help="Sections returned per question")
+    args = parser.parse_args()
+
+    rows, summary_rows, chunks = synthetic_history(max(args.days), args.articles_per_day, args.chunks_per_article, args.dims)
+    chunks_per_day = args.articles_per_day * args.chunks_per_article
+    rng = np.random.default_rng(1)
+
+    for n_days in sorted(args.days):
+        n_chunks = n_days * chunks_per_day
+        n_articles = n_days * args.articles_per_day
+        queries = chunks[rng.integers(n_chunks, size=args.queries)] + 1.2 * random_directions(rng, args.queries, args.dims)
+
+        start = time.perf_counter()
+        indexes = {
+            "summary": VectorIndex(rows[:n_chunks], summary_rows[:n_articles]),
+            "centroid": VectorIndex(rows[:n_chunks]),
+        }
+        build_seconds = (time.perf_counter() - start) / 2
+
+        p50, p95, exhaustive = time_searches(indexes["summary"], queries, args.k)
+        print(f"{n_days} days: {n_chunks:,} chunks in {n_articles:,} articles (index built in {build_seconds:.2f} s)")
+        print(f"  {'search':<24}{'p50':>10}{'p95':>12}{'recall@' + str(args.k):>12}")
+        print(f"  {'every chunk':<24}{p50 * 1000:>7.2f} ms{p95 * 1000:>9.2f} ms{1:>12.3f}")
+        for ranking, index in indexes.items():
+            for top_articles in args.top_articles:
+                if top_articles >= n_articles:
+                    continue
+                p50, p95, results = time_searches(index, queries, args.k, top_articles)
+                recall = np.mean([len(found & expected) / len(expected) for found, expected in zip(results, exhaustive)])
+                print(f"  {f'top {top_articles} by {ranking}':<24}{p50 * 1000:>7.2f} ms{p95 * 1000:>9.2f} ms{recall:>12.3f}")
+        print()
+
+
+if __name__ == "__main__":
+    main()
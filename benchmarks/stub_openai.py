@@ -0,0 +1,181 @@
+"""
+A local stand-in for the OpenAI ChatCompletion and Embedding endpoints, for benchmarking without an API key.
+
+Usage: python benchmarks/stub_openai.py [--port 8000] [--latency 0.2] [--rate-limit 0.05]
+
+Then set openai.api_base = "http://localhost:8000/v1". Responses are deterministic: the same input always gives the
+same summary, category or embedding. --latency adds a fixed delay to every request, and --rate-limit answers that
+fraction of requests with a 429, as the real API does when you exceed your rate limit.
+"""
+import argparse
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency: float = 0.0, rate_limit: float = 0.0, dims: int = 1536, seed: int = 0):
+        super().__init__(address, StubOpenAIHandler)
+        self.latency = latency  # Seconds added to every request
+        self.rate_limit = rate_limit  # Fraction of requests answered with a 429
+        self.dims = dims
+        self.random = random.Random(seed)  # Decides which requests are rate limited, so runs are repeatable
+        self.lock = threading.Lock()
+        self.stats = {}
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def count(self, endpoint: str, key: str, n: int = 1):
+        with self.lock:
+            endpoint_stats = self.stats.setdefault(endpoint, {"requests": 0, "rate_limited": 0, "inputs": 0, "tokens": 0})
+            endpoint_stats[key] += n
+
+    def is_rate_limited(self) -> bool:
+        with self.lock:
+            return self.random.random() < self.rate_limit
+
+
+def start_stub_server(host: str = "127.0.0.1", port: int = 0, **kwargs) -> StubOpenAIServer:
+    """Starts the stub server in a background thread. Port 0 picks a free port; see server.base_url."""
+    server = StubOpenAIServer((host, port), **kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def seeded_random(value) -> random.Random:
+    digest = hashlib.sha256(json.dumps(value, sort_keys=True).encode("utf-8")).digest()
+    return random.Random(int.from_bytes(digest[:8], "big"))
+
+
+def fake_embedding(value, dims: int) -> list:
+    rng = seeded_random(value)
+    vector = [rng.gauss(0, 1) for _ in range(dims)]
+    norm = math.sqrt(sum(x * x for x in vector))
+    return [x / norm for x in vector]
+
+
+def count_tokens(text: str) -> int:
+    # Roughly 4 tokens for every 3 words, which is close enough for reporting
+    return len(text.split()) * 4 // 3
+
+
+def fake_chat_reply(messages: list) -> str:
+    system = messages[0]["content"] if messages and messages[0]["role"] == "system" else ""
+    user = messages[-1]["content"]
+    rng = seeded_random(messages)
+    words = re.findall(r"[A-Za-z]+", user)
+
+    if "categoriser" in system:
+        topics = user.split("Here are a list of topics:\n", 1)[-1].split("\n\n\n\n", 1)[0].splitlines()
+        return rng.choice(topics)
+    elif "summariser" in system:
+        body = user.split("Article body: ", 1)[-1].split("\n\n\n\n\n\nOnly output the summary.", 1)[0]
+        body_words = body.split()
+        return " ".join(body_words[:len(body_words) // 2])
+    else:
+        summary = " ".join(rng.choice(words) for _ in range(60)) if words else "Nothing to summarise."
+        advisor = " ".join(rng.choice(words) for _ in range(30)) if words else "No comment."
+        return json.dumps({"summary": summary, "advisor": advisor})
+
+
+class StubOpenAIHandler(BaseHTTPRequestHandler):
+    server: StubOpenAIServer
+
+    def log_message(self, format, *args):
+        pass  # Keep benchmark output readable
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        endpoint = self.path.rstrip("/")
+
+        if endpoint not in ("/v1/chat/completions", "/v1/embeddings"):
+            self.send_json(404, {"error": {"message": f"Unknown endpoint {self.path}", "type": "invalid_request_error"}})
+            return
+
+        self.server.count(endpoint, "requests")
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        if self.server.is_rate_limited():
+            self.server.count(endpoint, "rate_limited")
+            self.send_json(429, {"error": {"message": "Rate limit reached for requests", "type": "requests", "code": None}})
+            return
+
+        if endpoint == "/v1/chat/completions":
+            self.chat_completion(body)
+        else:
+            self.embedding(body)
+
+    def chat_completion(self, body: dict):
+        messages = body.get("messages", [])
+        content = fake_chat_reply(messages)
+        prompt_tokens = sum(count_tokens(message["content"]) for message in messages)
+        completion_tokens = count_tokens(content)
+        self.server.count("/v1/chat/completions", "inputs")
+        self.server.count("/v1/chat/completions", "tokens", prompt_tokens + completion_tokens)
+
+        self.send_json(200, {
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-3.5-turbo"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens},
+        })
+
+    def embedding(self, body: dict):
+        # The input is a string, a list of tokens, or a list of either
+        inputs = body.get("input")
+        if isinstance(inputs, str) or (isinstance(inputs, list) and inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+
+        tokens = sum(len(item) if isinstance(item, list) else count_tokens(item) for item in inputs)
+        self.server.count("/v1/embeddings", "inputs", len(inputs))
+        self.server.count("/v1/embeddings", "tokens", tokens)
+
+        self.send_json(200, {
+            "object": "list",
+            "model": body.get("model", "text-embedding-ada-002"),
+            "data": [{"object": "embedding", "index": i, "embedding": fake_embedding(item, self.server.dims)} for i, item in enumerate(inputs)],
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        })
+
+    def send_json(self, status: int, body: dict):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a local stand-in for the OpenAI API")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every request")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="Fraction of requests answered with a 429")
+    parser.add_argument("--dims", type=int, default=1536, help="Embedding dimensions")
+    args = parser.parse_args()
+
+    server = StubOpenAIServer((args.host, args.port), latency=args.latency, rate_limit=args.rate_limit, dims=args.dims)
+    print(f"Serving a stub OpenAI API on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+import csv
+import glob
+import json
+import os
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from embeddings import Embeddings
+
+ARTICLE_EMBEDDINGS_FILE = "database/article_embeddings.csv"
+SUMMARY_EMBEDDINGS_FILE = "database/summary_embeddings.csv"
+VERSIONS_FILE = "database/embedding_versions.json"
+
+EMBEDDINGS_HEADER = ["article_uuid", "embedding_uuid", "text", "embedding", "version"]
+
+# Rows saved before embeddings were versioned were all made with ada-002, 200-token inputs and 100-word chunks.
+# Spelled out rather than taken from Embeddings() so that changing its defaults can't relabel those rows.
+LEGACY_PARAMETERS = {"model": "text-embedding-ada-002", "encoding": "cl100k_base", "ctx_length": 200, "words_per_chunk": 100, "step": 10}
+LEGACY_VERSION = "text-embedding-ada-002/cl100k_base/ctx200/chunk100-10"
+
+
+def row_version(row: Dict) -> str:
+    return row.get("version") or LEGACY_VERSION
+
+
+def load_versions(versions_file: str = VERSIONS_FILE) -> Dict:
+    """Returns {"active": version, "versions": {version: parameters}}"""
+    try:
+        with open(versions_file, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"active": LEGACY_VERSION, "versions": {LEGACY_VERSION: dict(LEGACY_PARAMETERS)}}
+
+
+def save_versions(versions: Dict, versions_file: str = VERSIONS_FILE):
+    # Write to a temporary file and rename it, so readers see either the old or the new versions, never half of each
+    with open(versions_file + ".tmp", "w") as f:
+        json.dump(versions, f, indent=2, sort_keys=True)
+    os.replace(versions_file + ".tmp", versions_file)
+
+
+def active_version(versions_file: str = VERSIONS_FILE) -> str:
+    """Returns the version that searches and new articles use"""
+    return load_versions(versions_file)["active"]
+
+
+def active_embedder(versions_file: str = VERSIONS_FILE) -> Embeddings:
+    versions = load_versions(versions_file)
+    return Embeddings(**embedder_arguments(versions["versions"][versions["active"]]))
+
+
+def embedder_arguments(parameters: Dict) -> Dict:
+    return {"model": parameters["model"], "encoding": parameters["encoding"], "ctx_length": parameters["ctx_length"],
+            "words_per_chunk": parameters["words_per_chunk"], "step": parameters["step"]}
+
+
+def register_version(embedder: Embeddings, status: str, versions_file: str = VERSIONS_FILE):
+    versions = load_versions(versions_file)
+    parameters = versions["versions"].get(embedder.version, {})
+    parameters.update(embedder.version_parameters())
+    parameters["status"] = status
+    parameters.setdefault("created", datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+    versions["versions"][embedder.version] = parameters
+    save_versions(versions, versions_file)
+
+
+def activate_version(version: str, versions_file: str = VERSIONS_FILE):
+    """Switches searches and new articles over to a version, in a single atomic write"""
+    versions = load_versions(versions_file)
+    if version not in versions["versions"]:
+        raise ValueError(f"Unknown embedding version {version}")
+    previous = versions["active"]
+    if previous in versions["versions"] and previous != version:
+        versions["versions"][previous]["status"] = "retired"
+    versions["versions"][version]["status"] = "active"
+    versions["active"] = version
+    save_versions(versions, versions_file)
+
+
+def ensure_version_column(embeddings_file: str):
+    """Adds the version column to an embeddings CSV written before embeddings were versioned"""
+    if not os.path.exists(embeddings_file) or os.path.getsize(embeddings_file) == 0:
+        return
+
+    with open(embeddings_file, "r", newline="") as f:
+        header = next(csv.reader(f), [])
+    if "version" in header:
+        return
+
+    with open(embeddings_file, "r", newline="") as f, open(embeddings_file + ".tmp", "w", newline="") as out:
+        reader = csv.DictReader(f)
+        writer = csv.writer(out)
+        writer.writerow(EMBEDDINGS_HEADER)
+        for row in reader:
+            writer.writerow([row["article_uuid"], row["embedding_uuid"], row["text"], row["embedding"], LEGACY_VERSION])
+    os.replace(embeddings_file + ".tmp", embeddings_file)
+
+
+def remove_rows(embeddings_file: str, version: str, article_uuids: Iterable[str]):
+    """Removes the rows of a version for the given articles"""
+    article_uuids = set(article_uuids)
+    if not article_uuids or not os.path.exists(embeddings_file):
+        return
+
+    with open(embeddings_file, "r", newline="") as f, open(embeddings_file + ".tmp", "w", newline="") as out:
+        reader = csv.DictReader(f)
+        writer = csv.DictWriter(out, fieldnames=EMBEDDINGS_HEADER)
+        writer.writeheader()
+        for row in reader:
+            if row_version(row) == version and row["article_uuid"] in article_uuids:
+                continue
+            writer.writerow({key: row.get(key) for key in EMBEDDINGS_HEADER})
+    os.replace(embeddings_file + ".tmp", embeddings_file)
+
+
+def version_filename(embeddings_file: str, version: str) -> str:
+    """Returns the file reembed.py writes a version's rows to, e.g. database/article_embeddings.<version>.csv. Only
+    reembed.py writes it, so it never appends to or rewrites a file the scraper is appending to."""
+    root, extension = os.path.splitext(embeddings_file)
+    return f"{root}.{version.replace('/', '_')}{extension}"
+
+
+def version_filenames(embeddings_file: str) -> List[str]:
+    """Returns the per-version files of an embeddings CSV that exist"""
+    root, extension = os.path.splitext(embeddings_file)
+    return sorted(glob.glob(f"{glob.escape(root)}.*{extension}"))
+
+
+def read_rows(embeddings_file: str, version: Optional[str] = None) -> Iterator[Dict]:
+    """Yields the rows of one version (the active one by default) from an embeddings CSV and from the version's own
+    file, so vectors of different models never mix.
+
+    An article saved just as reembed.py activates a version can be embedded by both the scraper and reembed.py, with
+    the same embedding UUIDs; only the first copy of each row is yielded, so it doesn't fill a search's results twice.
+    """
+    if version is None:
+        version = active_version()
+    seen = set()
+    for path in (embeddings_file, version_filename(embeddings_file, version)):
+        if not os.path.exists(path):
+            continue
+        with open(path, "r", newline="") as f:
+            for row in csv.DictReader(f):
+                key = (row["article_uuid"], row["embedding_uuid"])
+                if row_version(row) == version and key not in seen:
+                    seen.add(key)
+                    yield row
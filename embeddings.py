@@ -8,24 +8,49 @@ import os
 import tiktoken
 from typing import List, Dict, Optional, Tuple
 import json
+from tracing import traced, current_span, record_retry
 
 # Authenticate with the OpenAI API
 openai.api_key = os.environ.get("OPENAI_API_KEY")
 
 
 class Embeddings:
-    def __init__(self, model: str = 'text-embedding-ada-002', ctx_length: int = 200, encoding: str = 'cl100k_base'):
+    def __init__(self, model: str = 'text-embedding-ada-002', ctx_length: int = 200, encoding: str = 'cl100k_base', words_per_chunk: int = 100, step: int = 10):
         self.embedding_model = model
-        self.ctx_length = ctx_length  # The number of words per chunk
+        self.ctx_length = ctx_length  # The number of tokens per embedding call; longer texts are averaged
         self.encoding = encoding
+        self.words_per_chunk = words_per_chunk  # The number of words per stored article chunk
+        self.step = step  # The number of words adjacent chunks overlap by
         self.df_embeddings = pd.DataFrame()
 
+    # Identifies the vectors this embedder makes; vectors of different versions can't be compared
+    @property
+    def version(self) -> str:
+        return f"{self.embedding_model}/{self.encoding}/ctx{self.ctx_length}/chunk{self.words_per_chunk}-{self.step}"
+
+    def version_parameters(self) -> Dict:
+        return {"model": self.embedding_model, "encoding": self.encoding, "ctx_length": self.ctx_length, "words_per_chunk": self.words_per_chunk, "step": self.step}
+
     # Function to get the embedding for a given text
-    @retry(wait=wait_random_exponential(min=1, max=20), stop=stop_after_attempt(6), retry=retry_if_not_exception_type(openai.InvalidRequestError))
+    @traced("embed")
+    @retry(wait=wait_random_exponential(min=1, max=20), stop=stop_after_attempt(6), retry=retry_if_not_exception_type(openai.InvalidRequestError), before_sleep=record_retry)
     def get_embedding(self, text_or_tokens, model=None) -> List[float]:
         if model is None:
             model = self.embedding_model
-        return openai.Embedding.create(input=text_or_tokens, model=model)["data"][0]["embedding"]
+        response = openai.Embedding.create(input=text_or_tokens, model=model)
+        current_span().set("tokens", response["usage"]["total_tokens"])
+        return response["data"][0]["embedding"]
+
+    # Function to get the embeddings for several texts in a single API call
+    @traced("embed")
+    @retry(wait=wait_random_exponential(min=1, max=20), stop=stop_after_attempt(6), retry=retry_if_not_exception_type(openai.InvalidRequestError), before_sleep=record_retry)
+    def get_embeddings(self, texts: List[str], model=None) -> List[List[float]]:
+        if model is None:
+            model = self.embedding_model
+        response = openai.Embedding.create(input=texts, model=model)
+        current_span().set("inputs", len(texts))
+        current_span().set("tokens", response["usage"]["total_tokens"])
+        return [row["embedding"] for row in sorted(response["data"], key=lambda row: row["index"])]
 
     # Function to batch data into tuples of length n
     def batched(self, iterable: List, n: int) -> Tuple:
@@ -89,10 +114,35 @@ class Embeddings:
             chunk_embeddings = chunk_embeddings.tolist()
         return chunk_embeddings
 
+    # Function to get the embeddings for several texts in batched API calls, chunking each text if necessary
+    def len_safe_get_embeddings(self, texts: List[str], batch_size: int = 64) -> List[List[float]]:
+        """Same as len_safe_get_embedding(text, average=True) for each text, but embeds up to batch_size chunks per call"""
+        chunks = []
+        spans = []  # The (start, end) of each text's chunks
+        for text in texts:
+            start = len(chunks)
+            chunks.extend(list(chunk) for chunk in self.chunked_tokens(text, encoding_name=self.encoding, chunk_length=self.ctx_length))
+            spans.append((start, len(chunks)))
+
+        chunk_embeddings = []
+        for batch in self.batched(chunks, batch_size):
+            chunk_embeddings.extend(self.get_embeddings(list(batch)))
+
+        embeddings = []
+        for start, end in spans:
+            average = np.average(chunk_embeddings[start:end], axis=0, weights=[len(chunk) for chunk in chunks[start:end]])
+            embeddings.append((average / np.linalg.norm(average)).tolist())  # normalizes length to 1
+        return embeddings
+
     # Returns pandas dataframe with embeddings
     @staticmethod
-    def load_embeddings_from_database(embeddings_model_manager, text_column_name) -> pd.DataFrame:
-        embeddings = embeddings_model_manager.all().values(text_column_name, 'embeddings')  # Retrieve data from the Django model
+    def load_embeddings_from_database(embeddings_model_manager, text_column_name, version=None, article_column_name=None) -> pd.DataFrame:
+        embeddings = embeddings_model_manager.all()
+        # Only compare vectors made by the same model and chunking; a model without a version field holds a single version
+        if version is not None and any(field.name == 'version' for field in embeddings_model_manager.model._meta.get_fields()):
+            embeddings = embeddings.filter(version=version)
+        columns = [text_column_name, article_column_name] if article_column_name else [text_column_name]
+        embeddings = embeddings.values(*columns, 'embeddings')  # Retrieve data from the Django model
         df_embeddings = pd.DataFrame(embeddings)
         df_embeddings = df_embeddings.rename(
             columns={'embeddings': 'embedding'})  # Rename columns to match existing code
@@ -127,10 +177,37 @@ class Embeddings:
             print("An error occurred while loading embeddings:", e)
             return None
 
+    # Function to keep only the chunks of the top_articles articles most similar to the search term
+    def filter_top_articles(self, df_embeddings: pd.DataFrame, search_term_vector, top_articles: int, article_column_name: str,
+                            summary_model_manager=None, version: str = None) -> pd.DataFrame:
+        article_vectors = df_embeddings.groupby(article_column_name)['embedding'].apply(lambda chunks: np.mean(np.stack(chunks.values), axis=0))
+        if summary_model_manager is not None:
+            df_summaries = self.load_embeddings_from_database(summary_model_manager, article_column_name, version)
+            if not df_summaries.empty:
+                summaries = df_summaries.set_index(article_column_name)['embedding']
+                summaries = summaries[~summaries.index.duplicated(keep='last')]  # An article saved twice has two summaries
+                article_vectors = article_vectors.where(~article_vectors.index.isin(summaries.index), summaries.reindex(article_vectors.index))
+
+        article_similarity = article_vectors.apply(lambda x: cosine_similarity(x, search_term_vector))
+        top = article_similarity.nlargest(top_articles).index
+        return df_embeddings[df_embeddings[article_column_name].isin(top)]
+
     # Function to search for a given search term
-    def search(self, search_term: str, embeddings_model_manager, text_column_name: str, n: int = None) -> List[str]:
+    def search(self, search_term: str, embeddings_model_manager, text_column_name: str, n: int = None, version: str = None,
+               top_articles: int = None, article_column_name: str = 'article_uuid', summary_model_manager=None) -> List[str]:
+        """Searches the stored embeddings of one version (this embedder's by default), so vectors of different models
+        never mix.
+
+        If top_articles is given, the articles are ranked first (by their summary embedding in summary_model_manager, or
+        the centroid of their chunks) and only the chunks of the top_articles best articles are compared.
+        """
+        version = version or self.version
         search_term_vector = self.get_embedding(search_term)
-        self.df_embeddings = self.load_embeddings_from_database(embeddings_model_manager, text_column_name)
+        self.df_embeddings = self.load_embeddings_from_database(embeddings_model_manager, text_column_name, version,
+                                                                article_column_name if top_articles else None)
+        if top_articles and not self.df_embeddings.empty:
+            self.df_embeddings = self.filter_top_articles(self.df_embeddings, search_term_vector, top_articles,
+                                                          article_column_name, summary_model_manager, version)
 
         # Set n to the number of rows in the dataframe if it is not provided
         if n is None:
@@ -151,6 +228,96 @@ class Embeddings:
 
         return top_n[text_column_name].to_list()
 
+
+# Function to parse an embedding saved in the CSV database (written as a Python list, e.g. "[0.1, -0.2]")
+def parse_embedding(embedding_string) -> List[float]:
+    if not isinstance(embedding_string, str):
+        return embedding_string  # Already parsed
+    return json.loads(embedding_string)
+
+
+# Function to scale every row of a matrix to unit length, so cosine similarity becomes a single dot product
+def normalise_rows(matrix: np.ndarray) -> np.ndarray:
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.size == 0:
+        return matrix.reshape(0, matrix.shape[-1] if matrix.ndim == 2 else 0)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1  # Leave all-zero rows as they are instead of dividing by zero
+    return matrix / norms
+
+
+# Function to pack normalised vectors into little-endian bytes for the briefing page
+def pack_vectors(matrix: np.ndarray, dtype: str = "float32") -> bytes:
+    """Packs a 2D matrix row by row as float32 or float16 (half the size, ~3 significant digits)"""
+    if dtype == "float32":
+        return np.ascontiguousarray(matrix, dtype="<f4").tobytes()
+    elif dtype == "float16":
+        return np.ascontiguousarray(matrix, dtype="<f2").tobytes()
+    raise ValueError(f"Unsupported dtype {dtype}, expected 'float32' or 'float16'")
+
+# Function to return the rows of each article, as {article_uuid: [row index, ...]} in the order articles first appear
+def group_by_article(rows: List[Dict]) -> Dict[str, List[int]]:
+    rows_by_article = {}
+    for i, row in enumerate(rows):
+        rows_by_article.setdefault(row["article_uuid"], []).append(i)
+    return rows_by_article
+
+
+# Function to return one normalised vector per article: its summary embedding if there is one, else the centroid of its chunks
+def article_vectors(vectors: np.ndarray, rows_by_article: Dict[str, List[int]], summary_rows: Optional[List[Dict]] = None) -> np.ndarray:
+    summaries = {row["article_uuid"]: row["embedding"] for row in summary_rows or []}
+    return normalise_rows([
+        parse_embedding(summaries[article_uuid]) if article_uuid in summaries else vectors[article_rows].mean(axis=0)
+        for article_uuid, article_rows in rows_by_article.items()
+    ])
+
+
+class VectorIndex:
+    """An in-memory matrix of normalised embeddings, searched with one matrix-vector product per query.
+
+    It also keeps one vector per article: its summary embedding if summary_rows has one, otherwise the centroid of its
+    chunks. search(..., top_articles=M) first ranks the articles and then only scores the chunks of the best M.
+    """
+
+    def __init__(self, rows: List[Dict], summary_rows: Optional[List[Dict]] = None):
+        self.rows = rows
+        self.texts = [row["text"] for row in rows]
+        self.vectors = normalise_rows([parse_embedding(row["embedding"]) for row in rows])
+
+        rows_by_article = group_by_article(rows)
+        self.article_uuids = list(rows_by_article)
+        self.article_rows = [np.array(article_rows) for article_rows in rows_by_article.values()]
+        self.article_vectors = article_vectors(self.vectors, rows_by_article, summary_rows)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def search(self, query_vector: List[float], k: int = 5, top_articles: Optional[int] = None) -> List[Tuple[int, float]]:
+        """Returns the (row, similarity) pairs of the k rows most similar to the query, best first.
+
+        If top_articles is given, only the chunks of the top_articles articles most similar to the query are scored.
+        """
+        if len(self.rows) == 0 or k < 1:
+            return []
+        query = normalise_rows([query_vector])[0]
+
+        if top_articles and top_articles < len(self.article_uuids):
+            article_similarities = self.article_vectors @ query
+            top = np.argpartition(-article_similarities, top_articles - 1)[:top_articles]
+            candidates = np.concatenate([self.article_rows[article] for article in top])
+            similarities = self.vectors[candidates] @ query
+        else:
+            candidates = None
+            similarities = self.vectors @ query
+
+        # Partial top-k, then sort only those k
+        k = min(k, len(similarities))
+        top = np.argpartition(-similarities, k - 1)[:k]
+        top = top[np.argsort(-similarities[top])]
+        rows = top if candidates is None else candidates[top]
+        return [(int(row), float(similarities[i])) for row, i in zip(rows, top)]
+
+
 #long_text = 'AGI ' * 5000
 #try:
 #    get_embedding(long_text)
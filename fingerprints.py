@@ -0,0 +1,113 @@
+import csv
+import os
+import re
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from article_store import ensure_articles_header
+
+FINGERPRINTS_FILE = "database/fingerprints.csv"
+
+SHINGLE_SIZE = 5  # Words per shingle
+NUM_PERMUTATIONS = 128
+NUM_BANDS = 32  # 32 bands of 4 rows: pairs above ~0.5 similarity almost always share a band
+DUPLICATE_THRESHOLD = 0.85  # Estimated Jaccard similarity of the shingles above which an article is a near-duplicate
+MERSENNE_PRIME = (1 << 31) - 1
+
+# Fixed hash functions h(x) = (a * x + b) mod p, so signatures are comparable across runs
+_rng = np.random.RandomState(1)
+_A = _rng.randint(1, MERSENNE_PRIME, size=NUM_PERMUTATIONS, dtype=np.uint64)
+_B = _rng.randint(0, MERSENNE_PRIME, size=NUM_PERMUTATIONS, dtype=np.uint64)
+
+
+def normalise_text(text: str) -> str:
+    """Lowercases the text and removes punctuation and extra whitespace, so formatting changes don't matter"""
+    return " ".join(re.findall(r"[a-z0-9]+", text.lower()))
+
+
+def minhash_signature(text: str) -> Optional[np.ndarray]:
+    """Returns the MinHash signature of the text's word shingles, or None if the text has no words"""
+    words = normalise_text(text).split()
+    if not words:
+        return None
+
+    shingles = {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(max(len(words) - SHINGLE_SIZE + 1, 1))}
+    hashes = np.fromiter((zlib.crc32(shingle.encode("utf-8")) % MERSENNE_PRIME for shingle in shingles), dtype=np.uint64, count=len(shingles))
+
+    # One row per hash function, one column per shingle; the signature is the minimum of each row
+    permuted = (np.outer(_A, hashes) + _B[:, None]) % MERSENNE_PRIME
+    return permuted.min(axis=1).astype(np.uint32)
+
+
+def similarity(signature_a: np.ndarray, signature_b: np.ndarray) -> float:
+    """Estimates the Jaccard similarity of two texts from their signatures"""
+    return float(np.mean(signature_a == signature_b))
+
+
+class FingerprintIndex:
+    """MinHash signatures of every stored article, with LSH banding to find near-duplicates without comparing them all"""
+
+    def __init__(self, fingerprints_file: str = FINGERPRINTS_FILE):
+        self.fingerprints_file = fingerprints_file
+        self.signatures: Dict[str, np.ndarray] = {}
+        self.urls: Dict[str, str] = {}
+        self.buckets: Dict[Tuple[int, bytes], List[str]] = {}
+
+    @classmethod
+    def load(cls, fingerprints_file: str = FINGERPRINTS_FILE, articles_file: str = "database/articles.csv") -> "FingerprintIndex":
+        index = cls(fingerprints_file)
+        if os.path.exists(fingerprints_file):
+            with open(fingerprints_file, "r", newline="") as f:
+                reader = csv.DictReader(f)
+                for row in reader:
+                    index.index(row["article_uuid"], row["url"], np.frombuffer(bytes.fromhex(row["signature"]), dtype=np.uint32))
+        else:
+            # Fingerprint the articles saved before the index existed
+            ensure_articles_header(articles_file)
+            with open(articles_file, "r", newline="") as f:
+                reader = csv.DictReader(f)
+                for row in reader:
+                    signature = minhash_signature(row["text"])
+                    if signature is not None:
+                        index.add(row["UUID"], row["url"], signature)
+        return index
+
+    def bands(self, signature: np.ndarray):
+        rows_per_band = NUM_PERMUTATIONS // NUM_BANDS
+        for band in range(NUM_BANDS):
+            yield band, signature[band * rows_per_band:(band + 1) * rows_per_band].tobytes()
+
+    def index(self, article_uuid: str, url: str, signature: np.ndarray):
+        self.signatures[article_uuid] = signature
+        self.urls[article_uuid] = url
+        for key in self.bands(signature):
+            self.buckets.setdefault(key, []).append(article_uuid)
+
+    def add(self, article_uuid: str, url: str, signature: np.ndarray):
+        """Adds an article to the index and saves its signature"""
+        article_uuid = str(article_uuid)
+        self.index(article_uuid, url, signature)
+
+        with open(self.fingerprints_file, "a", newline="") as f:
+            writer = csv.writer(f)
+            if f.tell() == 0:
+                writer.writerow(["article_uuid", "url", "signature"])
+            writer.writerow([article_uuid, url, signature.astype(np.uint32).tobytes().hex()])
+
+    def find_duplicate(self, signature: Optional[np.ndarray], threshold: float) -> Optional[Tuple[str, float]]:
+        """Returns the UUID and similarity of the most similar stored article at or above the threshold, if any"""
+        if signature is None:
+            return None
+
+        candidates = set()
+        for key in self.bands(signature):
+            candidates.update(self.buckets.get(key, []))
+
+        best = None
+        for article_uuid in candidates:
+            score = similarity(signature, self.signatures[article_uuid])
+            if score >= threshold and (best is None or score > best[1]):
+                best = (article_uuid, score)
+        return best
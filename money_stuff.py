@@ -1,6 +1,8 @@
 import requests
 from bs4 import BeautifulSoup
 from datetime import datetime
+from tracing import span
+from fingerprints import minhash_signature
 
 
 def extract_text_from_newsletter_soup(html):
@@ -62,28 +64,34 @@ def scrape_money_stuff():
     search_url = f"{base_url}/newsletters/money-stuff-by-matt-levine"
 
     # Get the newsletter hunt page content
-    search_response = requests.get(search_url)
-    search_soup = BeautifulSoup(search_response.content, "html.parser")
+    with span("fetch", url=search_url):
+        search_response = requests.get(search_url)
+    with span("parse", url=search_url):
+        search_soup = BeautifulSoup(search_response.content, "html.parser")
 
     # Find the latest newsletter URL
     latest_newsletter_a = search_soup.find("ul", role="list").find("a", href=True)
     latest_newsletter_url = base_url + latest_newsletter_a["href"]
 
     # Get the latest newsletter content
-    newsletter_response = requests.get(latest_newsletter_url)
-    newsletter_soup = BeautifulSoup(newsletter_response.content, "html.parser")
+    with span("fetch", url=latest_newsletter_url):
+        newsletter_response = requests.get(latest_newsletter_url)
 
-    # Scrape the text from the latest newsletter
-    text = extract_text_from_newsletter_soup(newsletter_soup)
+    with span("parse", profile=True, url=latest_newsletter_url):
+        newsletter_soup = BeautifulSoup(newsletter_response.content, "html.parser")
 
-    # Get title and date from the newsletter
-    title, date = extract_title_and_date(newsletter_soup)
+        # Scrape the text from the latest newsletter
+        text = extract_text_from_newsletter_soup(newsletter_soup)
+
+        # Get title and date from the newsletter
+        title, date = extract_title_and_date(newsletter_soup)
 
     dict_to_return = {latest_newsletter_url: {
         "title": title,
         "date": date,
         "article_text": text,
-        "source": "Bloomberg"
+        "source": "Bloomberg",
+        "fingerprint": minhash_signature(text),
     }}
 
     return dict_to_return
@@ -0,0 +1,125 @@
+"""
+Reader profiles for personalised briefings.
+
+Profiles are defined in profiles.json (copy profiles.example.json to start); without it only the usual briefing is
+rendered:
+
+    [{"name": "markets", "interests": "Central banks, interest rates and financial markets",
+      "sources": ["Bloomberg"], "categories": ["Business and Economics"], "max_articles": 10}]
+
+sources and categories are optional filters (empty or missing means any), and max_articles caps the page. Each day's
+articles are ranked for every profile at once, by the similarity of their summary embeddings (already saved by
+save_embeddings) to the profile's interest vector. Interest vectors are embedded once per interests text and embedding
+version, and cached in database/interest_vectors.json, so a profile costs no API calls after its first run.
+"""
+import hashlib
+import json
+import os
+import re
+from typing import Dict, List
+
+import numpy as np
+
+from embeddings import Embeddings, parse_embedding, normalise_rows
+
+PROFILES_FILE = "profiles.json"
+INTEREST_VECTORS_FILE = "database/interest_vectors.json"
+
+MAX_ARTICLES = 20
+
+
+def load_profiles(profiles_file: str = PROFILES_FILE) -> List[Dict]:
+    """Returns the profiles in profiles_file, or no profiles if it doesn't exist"""
+    if not os.path.exists(profiles_file):
+        return []
+    with open(profiles_file, "r") as f:
+        definitions = json.load(f)
+
+    profiles = []
+    for definition in definitions:
+        name = definition.get("name", "")
+        if not re.fullmatch(r"[a-z0-9_-]+", name):
+            raise ValueError(f"Profile name {name!r} must be lowercase letters, digits, '-' or '_', as it is used in file names")
+        if not definition.get("interests"):
+            raise ValueError(f"Profile {name} has no interests")
+        profiles.append({
+            "name": name,
+            "interests": definition["interests"],
+            "sources": definition.get("sources") or [],
+            "categories": definition.get("categories") or [],
+            "max_articles": definition.get("max_articles", MAX_ARTICLES),
+        })
+    return profiles
+
+
+def profiles_hash(profiles: List[Dict], version: str) -> str:
+    """Changes whenever a profile or the embedding version changes, so the pages are re-rendered"""
+    return hashlib.sha1(json.dumps([profiles, version], sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class InterestVectorCache:
+    """Interest vectors keyed by the embedding version and the interests text, saved in a JSON file"""
+
+    def __init__(self, cache_file: str = INTEREST_VECTORS_FILE):
+        self.cache_file = cache_file
+        try:
+            with open(cache_file, "r") as f:
+                self.vectors = json.load(f)
+        except FileNotFoundError:
+            self.vectors = {}
+
+    @staticmethod
+    def key(version: str, interests: str) -> str:
+        return hashlib.sha1(f"{version}\0{interests}".encode("utf-8")).hexdigest()
+
+    def interest_vectors(self, profiles: List[Dict], embedder: Embeddings) -> Dict[str, List[float]]:
+        """Returns {profile name: interest vector}, embedding any new interests in a single batch"""
+        missing = sorted({profile["interests"] for profile in profiles if self.key(embedder.version, profile["interests"]) not in self.vectors})
+        if missing:
+            for interests, vector in zip(missing, embedder.len_safe_get_embeddings(missing)):
+                self.vectors[self.key(embedder.version, interests)] = vector
+            self.save()
+            print(f"  ✓ Embedded the interests of {len(missing)} profiles")
+        return {profile["name"]: self.vectors[self.key(embedder.version, profile["interests"])] for profile in profiles}
+
+    def save(self):
+        directory = os.path.dirname(self.cache_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.cache_file + ".tmp", "w") as f:
+            json.dump(self.vectors, f)
+        os.replace(self.cache_file + ".tmp", self.cache_file)
+
+
+def rank_articles(profiles: List[Dict], interest_vectors: Dict[str, List[float]], articles: Dict, summary_data: List[Dict]) -> Dict[str, Dict]:
+    """Returns each profile's articles ({url: article}), most relevant first, as {profile name: articles}.
+
+    Every article is scored against every profile with one matrix product of the summary and interest vectors.
+    Articles without a summary embedding are ranked last.
+    """
+    if not profiles:
+        return {}
+    summaries = {row["article_uuid"]: row["embedding"] for row in summary_data}
+    urls = list(articles)
+    interests = normalise_rows([interest_vectors[profile["name"]] for profile in profiles])
+    dims = interests.shape[1]
+    vectors = normalise_rows([parse_embedding(summaries[articles[url]["uuid"]]) if articles[url]["uuid"] in summaries else np.zeros(dims)
+                              for url in urls]).reshape(len(urls), dims)
+    has_summary = np.array([articles[url]["uuid"] in summaries for url in urls], dtype=bool)
+    scores = vectors @ interests.T  # One row per article, one column per profile
+    scores[~has_summary] = -np.inf
+
+    sources = np.array([articles[url]["source"] for url in urls], dtype=object)
+    categories = np.array([articles[url]["category"] for url in urls], dtype=object)
+    ranked = {}
+    for i, profile in enumerate(profiles):
+        allowed = np.ones(len(urls), dtype=bool)
+        if profile["sources"]:
+            allowed &= np.isin(sources, profile["sources"])
+        if profile["categories"]:
+            allowed &= np.isin(categories, profile["categories"])
+
+        candidates = np.flatnonzero(allowed)
+        order = candidates[np.argsort(-scores[candidates, i], kind="stable")][:profile["max_articles"]]
+        ranked[profile["name"]] = {urls[j]: articles[urls[j]] for j in order}
+    return ranked
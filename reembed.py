@@ -0,0 +1,230 @@
+"""
+Re-embeds the stored articles with another model or chunking, in the background, then switches searches over to it.
+
+Usage: python reembed.py --model text-embedding-3-small [--max-requests-per-minute 60] [--batch-size 64]
+
+Every embedding row carries the version that made it (see embedding_store.py) and searches only read the active
+version, so the old vectors keep answering while the new ones are written to the version's own files
+(database/article_embeddings.<version>.csv and database/summary_embeddings.<version>.csv), which the scraper never
+writes to. Progress is checkpointed after each batch; an interrupted job picks up where it stopped. Once every article
+has the new version it is activated in a single atomic write, and the scraper saves new articles with it. The old rows
+are kept, so `python reembed.py --activate <old version>` rolls back. Re-embedding to the active version is refused.
+Articles moved to the archive (see archive.py) are not re-embedded.
+"""
+import argparse
+import csv
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Set
+
+from article_store import ensure_articles_header
+from embeddings import Embeddings
+from embedding_store import (ARTICLE_EMBEDDINGS_FILE, SUMMARY_EMBEDDINGS_FILE, VERSIONS_FILE, EMBEDDINGS_HEADER,
+                             activate_version, load_versions, read_rows, register_version, remove_rows, version_filename)
+
+ARTICLES_FILE = "database/articles.csv"
+
+
+def checkpoint_filename(version: str) -> str:
+    return f"database/reembed_{version.replace('/', '_')}.checkpoint.json"
+
+
+class ReembeddingJob(threading.Thread):
+    """Embeds every stored article with the given embedder, batch_size texts per request and at most
+    max_requests_per_minute requests, then activates the new version"""
+
+    def __init__(self, embedder: Embeddings, batch_size: int = 64, max_requests_per_minute: int = 60, activate: bool = True,
+                 articles_file: str = ARTICLES_FILE, versions_file: str = VERSIONS_FILE):
+        super().__init__(daemon=True)
+        self.embedder = embedder
+        self.batch_size = batch_size
+        self.request_interval = 60 / max_requests_per_minute if max_requests_per_minute else 0
+        self.activate = activate
+        self.articles_file = articles_file
+        self.versions_file = versions_file
+        self.checkpoint_file = checkpoint_filename(embedder.version)
+        self.embeddings_files = [version_filename(file, embedder.version) for file in (ARTICLE_EMBEDDINGS_FILE, SUMMARY_EMBEDDINGS_FILE)]
+        self.done: Set[str] = set()
+        self.last_request = 0
+        self.error = None
+
+    def load_checkpoint(self):
+        try:
+            with open(self.checkpoint_file, "r") as f:
+                self.done = set(json.load(f)["done"])
+        except FileNotFoundError:
+            self.done = set()
+
+    def save_checkpoint(self):
+        with open(self.checkpoint_file + ".tmp", "w") as f:
+            json.dump({"version": self.embedder.version, "done": sorted(self.done)}, f)
+        os.replace(self.checkpoint_file + ".tmp", self.checkpoint_file)
+
+    def pending_articles(self) -> List[Dict]:
+        """Returns the stored articles that don't have embeddings of the new version yet, from this job or, once the
+        version is active, from the scraper"""
+        embedded = self.done | {row["article_uuid"] for row in read_rows(SUMMARY_EMBEDDINGS_FILE, self.embedder.version)}
+        with open(self.articles_file, "r", newline="") as f:
+            return [row for row in csv.DictReader(f) if row["UUID"] not in embedded]
+
+    def batches(self, articles: List[Dict]):
+        """Groups articles so that each batch holds about batch_size texts (an article's chunks and its summary)"""
+        batch, n_texts = [], 0
+        for article in articles:
+            chunks = [" ".join(chunk) for chunk in self.embedder.create_chunks(article["text"], words_per_chunk=self.embedder.words_per_chunk, step=self.embedder.step)]
+            if batch and n_texts + len(chunks) + 1 > self.batch_size:
+                yield batch
+                batch, n_texts = [], 0
+            batch.append((article, chunks))
+            n_texts += len(chunks) + 1
+        if batch:
+            yield batch
+
+    def throttle(self):
+        wait = self.last_request + self.request_interval - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        self.last_request = time.monotonic()
+
+    def embed_batch(self, batch):
+        texts = []
+        for article, chunks in batch:
+            texts.extend(chunks)
+            texts.append(article["summary"])
+
+        # Chunks are short enough that a batch is nearly always a single request
+        self.throttle()
+        embeddings = iter(self.embedder.len_safe_get_embeddings(texts, batch_size=self.batch_size))
+
+        version = self.embedder.version
+        with open(self.embeddings_files[0], "a", newline="") as a, open(self.embeddings_files[1], "a", newline="") as s:
+            writer_article = csv.writer(a)
+            writer_summary = csv.writer(s)
+            for article, chunks in batch:
+                article_uuid = article["UUID"]
+                writer_article.writerows([article_uuid, f"{article_uuid}_embedding-{i}", chunk_text, next(embeddings), version]
+                                         for i, chunk_text in enumerate(chunks))
+                writer_summary.writerow([article_uuid, f"{article_uuid}_embedding-summary", article["summary"], next(embeddings), version])
+            a.flush()
+            s.flush()
+
+        self.done.update(article["UUID"] for article, _ in batch)
+        self.save_checkpoint()
+
+    def catch_up(self):
+        """Embeds articles until none are pending, including any the scraper saved while the job was running"""
+        while True:
+            articles = self.pending_articles()
+            if not articles:
+                return
+            print(f"  • Re-embedding {len(articles)} articles ({len(self.done)} done)")
+            for batch in self.batches(articles):
+                self.embed_batch(batch)
+                print(f"    ✓ {len(self.done)} articles embedded with {self.embedder.version}")
+
+    def refusal(self, status, has_checkpoint):
+        """Returns why the job mustn't run, if it mustn't: it would rewrite the rows that searches are reading"""
+        version = self.embedder.version
+        if version == load_versions(self.versions_file)["active"]:
+            return f"{version} is already the active version; pick another model or chunking"
+        if status not in (None, "migrating") and not has_checkpoint:
+            return f"{version} is already {status}; switch to it with --activate {version}"
+        return None
+
+    def run(self):
+        version = self.embedder.version
+        status = load_versions(self.versions_file)["versions"].get(version, {}).get("status")
+        has_checkpoint = os.path.exists(self.checkpoint_file)
+        refusal = self.refusal(status, has_checkpoint)
+        if refusal:
+            self.error = ValueError(refusal)
+            print(f"  ✗ {refusal}")
+            return
+
+        try:
+            ensure_articles_header(self.articles_file)
+            if has_checkpoint:
+                # Rows written after the last checkpoint belong to a batch that didn't finish; drop them and embed it again
+                self.load_checkpoint()
+                if status == "migrating":
+                    with open(self.articles_file, "r", newline="") as f:
+                        unfinished = {row["UUID"] for row in csv.DictReader(f)} - self.done
+                    for embeddings_file in self.embeddings_files:
+                        remove_rows(embeddings_file, version, unfinished)
+            else:
+                # No batch has finished, so nothing in the version's own files is worth keeping
+                for embeddings_file in self.embeddings_files:
+                    if os.path.exists(embeddings_file):
+                        os.remove(embeddings_file)
+
+            register_version(self.embedder, "migrating", self.versions_file)
+            for embeddings_file in self.embeddings_files:
+                with open(embeddings_file, "a", newline="") as f:
+                    if f.tell() == 0:
+                        csv.writer(f).writerow(EMBEDDINGS_HEADER)
+
+            self.catch_up()
+            if not self.activate:
+                register_version(self.embedder, "ready", self.versions_file)
+                print(f"  ✓ Embedded every article with {version}; activate it with --activate {version}")
+                return
+
+            activate_version(version, self.versions_file)
+            # The scraper may have saved articles with the old version just before the switch
+            self.catch_up()
+            os.remove(self.checkpoint_file)
+            print(f"  ✓ Switched to {version}")
+        except Exception as e:
+            self.error = e
+            print(f"  ✗ Re-embedding stopped: {e}. Run it again to resume from the last checkpoint.")
+
+
+def print_status(versions_file: str = VERSIONS_FILE):
+    versions = load_versions(versions_file)
+    for version, parameters in versions["versions"].items():
+        marker = "✓" if version == versions["active"] else "•"
+        progress = ""
+        if os.path.exists(checkpoint_filename(version)):
+            with open(checkpoint_filename(version), "r") as f:
+                progress = f", {len(json.load(f)['done'])} articles embedded"
+        print(f"  {marker} {version} ({parameters.get('status', 'active')}{progress})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-embed the stored articles with another embedding model or chunking")
+    parser.add_argument("--model", default="text-embedding-ada-002")
+    parser.add_argument("--encoding", default="cl100k_base")
+    parser.add_argument("--ctx-length", type=int, default=200, help="Tokens per embedding request input")
+    parser.add_argument("--words-per-chunk", type=int, default=100)
+    parser.add_argument("--step", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=64, help="Texts per embeddings request")
+    parser.add_argument("--max-requests-per-minute", type=int, default=60)
+    parser.add_argument("--no-activate", action="store_true", help="Embed everything but keep the current version active")
+    parser.add_argument("--activate", metavar="VERSION", help="Switch to an already embedded version, e.g. to roll back")
+    parser.add_argument("--status", action="store_true", help="List the embedding versions and the progress of any migration")
+    args = parser.parse_args()
+
+    if args.status:
+        print_status()
+        return
+    if args.activate:
+        activate_version(args.activate)
+        print(f"  ✓ Switched to {args.activate}")
+        return
+
+    embedder = Embeddings(model=args.model, encoding=args.encoding, ctx_length=args.ctx_length,
+                          words_per_chunk=args.words_per_chunk, step=args.step)
+    print(f"Re-embedding the stored articles with {embedder.version}")
+    job = ReembeddingJob(embedder, batch_size=args.batch_size, max_requests_per_minute=args.max_requests_per_minute,
+                         activate=not args.no_activate)
+    job.start()
+    try:
+        job.join()
+    except KeyboardInterrupt:
+        print("  • Stopped; progress is saved in the checkpoint")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,457 @@
+import base64
+import csv
+import hashlib
+import io
+import json
+import os
+import re
+import string
+from datetime import datetime
+
+from embeddings import parse_embedding, normalise_rows, pack_vectors, group_by_article, article_vectors
+from tracing import span
+from embedding_store import load_versions, read_rows
+from profiles import profiles_hash, rank_articles
+
+ARTICLES_FILE = "database/articles.csv"
+EMBEDDINGS_FILE = "database/article_embeddings.csv"
+SUMMARY_EMBEDDINGS_FILE = "database/summary_embeddings.csv"
+RETRIEVAL_TOKEN_FILE = "database/retrieval_token"
+
+PAGE_TEMPLATE = """<!DOCTYPE html>
+    <html lang="en">
+    <head>
+        <meta charset="UTF-8">
+        <meta name="viewport" content="width=device-width, initial-scale=1.0">
+        <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.0-alpha1/dist/css/bootstrap.min.css" rel="stylesheet">
+        <link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/bootstrap-icons@1.10.3/font/bootstrap-icons.css">
+        <title>Your Daily Briefing</title>
+        <style>
+            {styles}
+        </style>
+    </head>
+    <body>
+        <h1>Your world in brief</h1>
+        {articles_html}
+        
+        <div class="chatbot-container">
+            <button id="chatbot-button" class="btn btn-primary rounded-circle">
+                <i class="bi bi-chat-dots-fill"></i>
+            </button>
+            <div id="chatbot-box" class="card d-none">
+                <div class="card-body">
+
+
+                    <div class="chat">
+                        <div id="chatbot-messages" class="messages"></div>
+                    </div>
+
+
+                    <div id="chatbot-messages" class="mb-3"></div>
+                    <div class="input-group chatbot-input-container">
+                        <input type="text" id="chatbot-input" class="form-control" placeholder="Type your message...">
+                        <div class="input-group-append">
+                            <button id="chatbot-send" class="btn"><i class="bi bi-arrow-right-circle"></i></button>
+                        </div>
+                    </div>
+                </div>
+            </div>
+        </div>
+    </body>
+    <script>
+        const OPENAI_API_KEY = "{openai_api_key}";
+        const embeddingsIndex = {embeddings_index}; // normalised vectors, see build_embeddings_index()
+        const RETRIEVAL_URL = {retrieval_url}; // e.g. "http://localhost:8765", see retrieval_server.py
+        const RETRIEVAL_TOKEN = {retrieval_token}; // Sent with every search; the server refuses requests without it
+        {scripts}
+    </script>
+    </html>
+    """
+
+CATEGORY_TEMPLATE = """<div class='category fade-in fade-in-category'>
+            <h2>{category}</h2>
+        <hr>"""
+
+ARTICLE_TEMPLATE = """
+        <div class="article">
+            <div class="header">
+                <div class="header-left">
+                    <img class="logo fade-in fade-in-logo" src="{logo_url}" alt="Source logo" />
+                    <div class="title-date fade-in fade-in-title-date">
+                        <a href="{url}" target="_blank"><h2>{title}</h2></a>
+                        <span class="date">{date}</span>
+                    </div>    
+                </div>
+            </div>
+            <p class="fade-in fade-in-summary">{summary}</p>
+            <p class="fade-in fade-in-opinion"><span style="color: #E3120B;">Opinion:</span> {opinion}</p>
+            </div>
+        </div>
+    """
+
+INDEX_TEMPLATE = """<!DOCTYPE html>
+    <html lang="en">
+    <head>
+        <meta charset="UTF-8">
+        <meta name="viewport" content="width=device-width, initial-scale=1.0">
+        <title>Your world in brief: archive</title>
+        <style>
+            {styles}
+        </style>
+    </head>
+    <body>
+        <h1>Your world in brief</h1>
+        <ul class="archive">
+{entries}
+        </ul>
+    </body>
+    </html>
+    """
+
+INDEX_ENTRY_TEMPLATE = """            <li data-day="{day}"><a href="{filename}">{formatted_date}</a><span class="date">{details}</span>{profile_links}</li>\n"""
+
+SOURCE_LOGOS = {
+    "The Economist": "https://www.economist.com/engassets/google-search-logo.f1ea908894.png",
+    "Bloomberg": "https://pbs.twimg.com/profile_images/1016326195221352450/KCcdUN0v_400x400.jpg",
+}
+DEFAULT_LOGO = "http://brentapac.com/wp-content/uploads/2017/03/transparent-square.png"
+
+
+def compile_template(template):
+    """Splits a str.format template once into (literal text, field name) pairs"""
+    return [(literal, field) for literal, field, _, _ in string.Formatter().parse(template)]
+
+
+def render_template(compiled_template, values, file):
+    """Writes a compiled template to a file. A value may be a function, which is called to stream its own output."""
+    for literal, field in compiled_template:
+        file.write(literal)
+        if field is not None:
+            value = values[field]
+            if callable(value):
+                value(file)
+            else:
+                file.write(str(value))
+
+
+def build_embeddings_index(embeddings_data, dtype="float32", vectors_file=None, model="text-embedding-ada-002", summary_data=None) -> dict:
+    """Packs the embedding rows into a compact index for scripts.js.
+
+    The vectors are normalised and stored as one base64 blob of float32 (or float16) values, row by row, so the page
+    can search them with a single dot product per row. If vectors_file is given, the blob is written to that file
+    instead and loaded lazily by the page on the first question (the page must then be served over HTTP, as browsers
+    block fetch() from file:// pages). model is the embedding model the page must embed questions with.
+
+    The chunk rows are grouped by article, and the blob ends with one vector per article (its summary embedding from
+    summary_data, or the centroid of its chunks), so the page can rank articles first. Article i owns the chunk rows
+    article_starts[i] to article_starts[i + 1].
+    """
+    rows_by_article = group_by_article(embeddings_data)
+    embeddings_data = [embeddings_data[i] for article_rows in rows_by_article.values() for i in article_rows]
+    rows_by_article = group_by_article(embeddings_data)
+    article_starts = [0]
+    for article_rows in rows_by_article.values():
+        article_starts.append(article_starts[-1] + len(article_rows))
+
+    vectors = normalise_rows([parse_embedding(row["embedding"]) for row in embeddings_data])
+    dims = vectors.shape[1]
+    packed = pack_vectors(vectors, dtype=dtype) + pack_vectors(article_vectors(vectors, rows_by_article, summary_data), dtype=dtype)
+
+    index = {
+        "count": len(embeddings_data),
+        "dims": dims,
+        "dtype": dtype,
+        "model": model,
+        "article_uuids": [row["article_uuid"] for row in embeddings_data],
+        "texts": [row["text"] for row in embeddings_data],
+        "article_count": len(rows_by_article),
+        "article_starts": article_starts,
+        "vectors": None,
+        "vectors_url": None,
+    }
+
+    if vectors_file is None:
+        index["vectors"] = base64.b64encode(packed).decode("ascii")
+    else:
+        with open(vectors_file, "wb") as f:
+            f.write(packed)
+        index["vectors_url"] = os.path.basename(vectors_file)
+
+    return index
+
+
+def load_articles_by_day(articles_file=ARTICLES_FILE) -> dict:
+    """Returns the stored articles grouped by the day they were added, as {day: {url: article}}"""
+    articles_by_day = {}
+    with open(articles_file, "r", newline="") as csvfile:
+        reader = csv.DictReader(csvfile)
+        for row in reader:
+            try:
+                date_added = datetime.strptime(row["date_added"], "%Y-%m-%d %H:%M:%S")
+                publication_date = datetime.strptime(row["publication_date"], "%Y-%m-%d %H:%M:%S")
+            except (ValueError, TypeError):
+                print(f"Article UUID {row['UUID']} has an invalid date: {row['date_added']}")
+                continue
+
+            day = date_added.strftime("%Y-%m-%d")
+            articles_by_day.setdefault(day, {})[row["url"]] = {
+                "uuid": row["UUID"],
+                "title": row["title"],
+                "date": publication_date,
+                "category": row["category"],
+                "source": row["source"],
+                "summary": row["summary"],
+                "opinion": row["opinion"],
+            }
+
+    return articles_by_day
+
+
+def retrieval_token(token_file=RETRIEVAL_TOKEN_FILE) -> str:
+    """Returns the token briefings send with their searches, creating it on first use. retrieval_server.py refuses
+    requests without it, so other pages can't read the articles through it or make it call the embeddings API."""
+    try:
+        with open(token_file, "r") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        pass
+
+    token = os.urandom(24).hex()
+    try:
+        with os.fdopen(os.open(token_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), "w") as f:
+            f.write(token)
+    except FileExistsError:
+        return retrieval_token(token_file)  # The server or scraper created it at the same time
+    return token
+
+
+class BriefingRenderer:
+    def __init__(self, output_dir="briefings", styles_file="styles.css", scripts_file="scripts.js", embeddings_dtype="float32", sidecar_embeddings=False, retrieval_url=None):
+        self.output_dir = output_dir
+        self.embeddings_dtype = embeddings_dtype
+        self.sidecar_embeddings = sidecar_embeddings  # Write each day's vectors next to the page instead of inline
+        self.retrieval_url = retrieval_url  # If set, pages ask retrieval_server.py for related sections instead
+        self.retrieval_token = retrieval_token() if retrieval_url is not None else None
+        self.manifest_file = os.path.join(output_dir, "manifest.json")
+        self.index_file = os.path.join(output_dir, "index.html")
+
+        with open(styles_file, "r") as f:
+            self.styles = f.read()
+
+        with open(scripts_file, "r") as f:
+            self.scripts = f.read()
+
+        # Compile the templates once, rather than formatting them for every page
+        self.page_template = compile_template(PAGE_TEMPLATE)
+        self.category_template = compile_template(CATEGORY_TEMPLATE)
+        self.article_template = compile_template(ARTICLE_TEMPLATE)
+        self.index_template = compile_template(INDEX_TEMPLATE)
+        self.index_entry_template = compile_template(INDEX_ENTRY_TEMPLATE)
+
+        # Any change to the templates, styles, scripts or options means every day must be re-rendered
+        template_hash = hashlib.sha1()
+        for part in (PAGE_TEMPLATE, CATEGORY_TEMPLATE, ARTICLE_TEMPLATE, self.styles, self.scripts, embeddings_dtype, str(sidecar_embeddings), str(retrieval_url), str(self.retrieval_token)):
+            template_hash.update(part.encode("utf-8"))
+        self.template_hash = template_hash.hexdigest()
+
+    @staticmethod
+    def briefing_filename(day: str, profile: str = None) -> str:
+        if profile is not None:
+            return f"your_world_in_brief_{day}_{profile}.html"
+        return f"your_world_in_brief_{day}.html"
+
+    def write_page(self, file, articles, embeddings_data, vectors_file=None, model="text-embedding-ada-002", summary_data=None):
+        """Streams the briefing page for the given articles ({url: article}) to an open file"""
+        if self.retrieval_url is None:
+            embeddings_index = build_embeddings_index(embeddings_data, dtype=self.embeddings_dtype, vectors_file=vectors_file,
+                                                      model=model, summary_data=summary_data)
+        else:
+            embeddings_index = None
+
+        # Escape "</" so chunk text can never close the inline <script> tag
+        embeddings_index = json.dumps(embeddings_index).replace("</", "<\\/")
+
+        values = {
+            "styles": self.styles,
+            "scripts": self.scripts,
+            "articles_html": lambda f: self.write_articles(f, articles),
+            "embeddings_index": embeddings_index,
+            "retrieval_url": json.dumps(self.retrieval_url),
+            "retrieval_token": json.dumps(self.retrieval_token),
+            "openai_api_key": os.environ.get("OPENAI_API_KEY"),
+        }
+        render_template(self.page_template, values, file)
+
+    def write_articles(self, file, articles):
+        # Group the articles by category, keeping the order they were added in
+        categories = {}
+        for url, article in articles.items():
+            categories.setdefault(article["category"], []).append({"url": url, **article})
+
+        for category, articles_in_category in categories.items():
+            render_template(self.category_template, {"category": category}, file)
+            for article in articles_in_category:
+                values = {
+                    "title": article["title"],
+                    "summary": article["summary"],
+                    "url": article["url"],
+                    "logo_url": SOURCE_LOGOS.get(article["source"], DEFAULT_LOGO),
+                    "date": article["date"].strftime("%d %B %Y"),
+                    "opinion": article["opinion"],
+                }
+                render_template(self.article_template, values, file)
+
+    def render_day(self, day: str, articles, embeddings_data, model="text-embedding-ada-002", summary_data=None, profile=None):
+        """Writes the briefing page for a day (or a profile's page), replacing the previous one only once it is complete"""
+        filename = self.briefing_filename(day, profile)
+        path = os.path.join(self.output_dir, filename)
+        vectors_file = None
+        if self.sidecar_embeddings and self.retrieval_url is None:
+            vectors_file = os.path.join(self.output_dir, filename[:-len(".html")] + ".embeddings.bin")
+
+        with span("render", profile=True, day=day, reader=profile, articles=len(articles), chunks=len(embeddings_data)):
+            with open(path + ".tmp", "w") as file:
+                self.write_page(file, articles, embeddings_data, vectors_file=vectors_file, model=model, summary_data=summary_data)
+            os.replace(path + ".tmp", path)
+
+    def day_hash(self, articles, embeddings_data, summary_data, version: str, profiles_hash: str = "") -> str:
+        day_hash = hashlib.sha1(self.template_hash.encode("utf-8"))
+        day_hash.update(version.encode("utf-8"))
+        day_hash.update(profiles_hash.encode("utf-8"))
+        for url, article in articles.items():
+            for value in (article["uuid"], url, article["title"], article["category"], article["summary"], article["opinion"]):
+                day_hash.update(value.encode("utf-8"))
+                day_hash.update(b"\0")
+        for row in embeddings_data + summary_data:
+            day_hash.update(row["embedding_uuid"].encode("utf-8"))
+        return day_hash.hexdigest()
+
+    def render_changed_days(self, articles_file=ARTICLES_FILE, embeddings_file=EMBEDDINGS_FILE, summary_embeddings_file=SUMMARY_EMBEDDINGS_FILE,
+                            profiles=None, interest_vectors=None) -> list:
+        """Re-renders every day whose articles or embeddings changed since the last run, and returns those days.
+
+        With profiles (see profiles.py) and their interest vectors, each day also gets one page per profile, with the
+        profile's articles ranked by relevance.
+        """
+        profiles = profiles or []
+        articles_by_day = load_articles_by_day(articles_file)
+        day_by_article_uuid = {}
+        for day, articles in articles_by_day.items():
+            for article in articles.values():
+                day_by_article_uuid[article["uuid"]] = day
+
+        # Only use the active embedding version; switching versions re-renders every day
+        versions = load_versions()
+        version = versions["active"]
+        model = versions["versions"][version]["model"]
+
+        # Scan the embeddings once for every day, rather than once per page
+        embeddings_by_day = {day: [] for day in articles_by_day}
+        summaries_by_day = {day: [] for day in articles_by_day}
+        files = []
+        if self.retrieval_url is None:
+            files.append((embeddings_file, embeddings_by_day))
+        if self.retrieval_url is None or profiles:
+            files.append((summary_embeddings_file, summaries_by_day))  # Profiles rank the articles by their summaries
+        for file, rows_by_day in files:
+            for row in read_rows(file, version):
+                day = day_by_article_uuid.get(row["article_uuid"])
+                if day is not None:
+                    rows_by_day[day].append(row)
+
+        # Days moved to the archive (see archive.py) aren't in articles.csv, so their pages are left as they are
+        manifest = self.load_manifest()
+        rendered_days = []
+        profile_names = [profile["name"] for profile in profiles]
+        for day in sorted(articles_by_day):
+            articles = articles_by_day[day]
+            day_hash = self.day_hash(articles, embeddings_by_day[day], summaries_by_day[day], version, profiles_hash(profiles, version) if profiles else "")
+            if manifest.get(day, {}).get("hash") == day_hash:
+                continue
+
+            if profiles:
+                # Parse the day's vectors once for all of its pages, rather than once per page
+                for row in embeddings_by_day[day] + summaries_by_day[day]:
+                    row["embedding"] = parse_embedding(row["embedding"])
+
+            self.render_day(day, articles, embeddings_by_day[day], model=model, summary_data=summaries_by_day[day])
+
+            # Every profile's page reuses the day's summaries and embeddings; only the ranking differs
+            for name, profile_articles in rank_articles(profiles, interest_vectors, articles, summaries_by_day[day]).items():
+                uuids = {article["uuid"] for article in profile_articles.values()}
+                profile_embeddings = [row for row in embeddings_by_day[day] if row["article_uuid"] in uuids]
+                profile_summaries = [row for row in summaries_by_day[day] if row["article_uuid"] in uuids]
+                self.render_day(day, profile_articles, profile_embeddings, model=model, summary_data=profile_summaries, profile=name)
+
+            manifest[day] = {"hash": day_hash, "articles": len(articles), "profiles": profile_names}
+            self.save_manifest(manifest)
+            self.update_index(day, len(articles), profile_names)
+            rendered_days.append(day)
+
+        return rendered_days
+
+    def load_manifest(self) -> dict:
+        """Returns {day: {"hash": ..., "articles": n}} for every day rendered so far"""
+        try:
+            with open(self.manifest_file, "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def save_manifest(self, manifest):
+        with open(self.manifest_file + ".tmp", "w") as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        os.replace(self.manifest_file + ".tmp", self.manifest_file)
+
+    def index_entry(self, day: str, n_articles=None, profile_names=()) -> str:
+        entry = io.StringIO()
+        details = f" ({n_articles} articles)" if n_articles is not None else ""
+        values = {
+            "day": day,
+            "filename": self.briefing_filename(day),
+            "formatted_date": datetime.strptime(day, "%Y-%m-%d").strftime("%d %B %Y"),
+            "details": details,
+            "profile_links": "".join(f' · <a href="{self.briefing_filename(day, name)}">{name}</a>' for name in profile_names),
+        }
+        render_template(self.index_entry_template, values, entry)
+        return entry.getvalue()
+
+    def update_index(self, day: str, n_articles: int, profile_names=()):
+        """Adds or replaces the day's entry in briefings/index.html, newest day first, leaving the other entries as they are"""
+        if not os.path.exists(self.index_file):
+            self.create_index()
+
+        with open(self.index_file, "r") as f:
+            lines = f.readlines()
+
+        entry_pattern = re.compile(r'\s*<li data-day="(\d{4}-\d{2}-\d{2})">')
+        new_entry = self.index_entry(day, n_articles, profile_names)
+        insert_at = None
+        for i, line in enumerate(lines):
+            match = entry_pattern.match(line)
+            if match is None:
+                if line.strip() == "</ul>" and insert_at is None:
+                    insert_at = i
+                continue
+            if match.group(1) == day:
+                lines[i] = new_entry
+                break
+            if match.group(1) < day and insert_at is None:
+                insert_at = i
+        else:
+            lines.insert(insert_at, new_entry)
+
+        with open(self.index_file + ".tmp", "w") as f:
+            f.writelines(lines)
+        os.replace(self.index_file + ".tmp", self.index_file)
+
+    def create_index(self):
+        """Creates briefings/index.html, listing the briefings already in the output directory"""
+        filename_pattern = re.compile(r"your_world_in_brief_(\d{4}-\d{2}-\d{2})\.html$")
+        days = sorted((match.group(1) for match in map(filename_pattern.match, os.listdir(self.output_dir)) if match), reverse=True)
+        manifest = self.load_manifest()
+        entries = "".join(self.index_entry(day, manifest.get(day, {}).get("articles"), manifest.get(day, {}).get("profiles", [])) for day in days)
+
+        with open(self.index_file, "w") as f:
+            render_template(self.index_template, {"styles": self.styles, "entries": entries.rstrip("\n")}, f)
+
@@ -0,0 +1,206 @@
+"""
+A small localhost HTTP service that answers the briefing chatbot's searches.
+
+Usage: python retrieval_server.py [--port 8765] [--days 1]
+
+It loads the day's embeddings once, then answers GET /search?q=<question>&k=<n>&m=<articles> with the text of the k
+most related article sections, scoring only the sections of the m articles whose summaries are most related
+(--top-articles by default; 0, the default, scores every section). Query embeddings are kept in an LRU cache, and questions that arrive at the same time are embedded
+together in a single API call. Point a briefing at it with generate_html_page(..., retrieval_url="http://localhost:8765").
+
+Every search must carry the token in database/retrieval_token (created by whichever of the server and the renderer runs
+first, and baked into the pages), so other pages can neither read the results, even from a sandboxed iframe whose
+origin is "null", nor run up embedding calls with requests they can't read.
+"""
+import argparse
+import hmac
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from queue import Queue, Empty
+from typing import List, Optional
+from urllib.parse import urlparse, parse_qs
+
+from article_store import ensure_articles_header
+from embeddings import Embeddings, VectorIndex
+from embedding_store import active_embedder
+from renderer import retrieval_token
+from scraper import load_recent_embeddings
+
+
+class QueryEmbeddingCache:
+    """A thread-safe LRU cache of query text -> embedding"""
+
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, text: str) -> Optional[List[float]]:
+        with self.lock:
+            embedding = self.cache.get(text)
+            if embedding is not None:
+                self.cache.move_to_end(text)
+            return embedding
+
+    def put(self, text: str, embedding: List[float]):
+        with self.lock:
+            self.cache[text] = embedding
+            self.cache.move_to_end(text)
+            while len(self.cache) > self.max_size:
+                self.cache.popitem(last=False)
+
+
+class QueryBatcher:
+    """Collects the queries that arrive within batch_window seconds of each other and embeds them in one API call"""
+
+    def __init__(self, embedder: Embeddings, cache: QueryEmbeddingCache, batch_window: float = 0.02, max_batch_size: int = 64):
+        self.embedder = embedder
+        self.cache = cache
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.queue = Queue()
+        self.worker = threading.Thread(target=self.run, daemon=True)
+        self.worker.start()
+
+    def embed(self, text: str) -> List[float]:
+        embedding = self.cache.get(text)
+        if embedding is not None:
+            return embedding
+
+        future = Future()
+        self.queue.put((text, future))
+        return future.result()
+
+    def run(self):
+        while True:
+            # Wait for the first query, then give concurrent queries a short window to join the batch
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.batch_window
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=timeout))
+                except Empty:
+                    break
+
+            # Identical questions in the same batch are only embedded once
+            futures_by_text = {}
+            for text, future in batch:
+                futures_by_text.setdefault(text, []).append(future)
+            texts = list(futures_by_text)
+
+            try:
+                embeddings = self.embedder.get_embeddings(texts)
+            except Exception as e:
+                for futures in futures_by_text.values():
+                    for future in futures:
+                        future.set_exception(e)
+                continue
+
+            for text, embedding in zip(texts, embeddings):
+                self.cache.put(text, embedding)
+                for future in futures_by_text[text]:
+                    future.set_result(embedding)
+
+
+class RetrievalHandler(BaseHTTPRequestHandler):
+    index: VectorIndex = None
+    batcher: QueryBatcher = None
+    top_articles: int = 0
+    token: str = None
+    allowed_origins = {"null"}  # Briefings opened from file:// send "Origin: null"
+
+    def do_GET(self):
+        # Browsers send the request even when the response can't be read, so refuse other sites before embedding anything
+        origin = self.headers.get("Origin")
+        if origin is not None and origin not in self.allowed_origins:
+            self.send_json(403, {"error": f"Origin {origin} is not allowed"})
+            return
+
+        url = urlparse(self.path)
+        if url.path != "/search":
+            self.send_json(404, {"error": "Not found"})
+            return
+
+        params = parse_qs(url.query)
+        if not hmac.compare_digest(params.get("token", [""])[0], self.token):
+            self.send_json(403, {"error": "Missing or wrong token"})
+            return
+        query = params.get("q", [""])[0].strip()
+        if not query:
+            self.send_json(400, {"error": "Missing query parameter q"})
+            return
+        try:
+            k = int(params.get("k", ["5"])[0])
+            top_articles = int(params.get("m", [self.top_articles])[0])
+        except ValueError:
+            self.send_json(400, {"error": "Query parameters k and m must be integers"})
+            return
+
+        try:
+            query_vector = self.batcher.embed(query)
+        except Exception as e:
+            self.send_json(502, {"error": f"Error embedding query: {e}"})
+            return
+
+        results = []
+        for row, similarity in self.index.search(query_vector, k, top_articles=top_articles):
+            results.append({
+                "article_uuid": self.index.rows[row]["article_uuid"],
+                "embedding_uuid": self.index.rows[row]["embedding_uuid"],
+                "text": self.index.texts[row],
+                "similarity": similarity,
+            })
+        self.send_json(200, {"results": results})
+
+    def send_json(self, status: int, body: dict):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        origin = self.headers.get("Origin")
+        if origin in self.allowed_origins:
+            self.send_header("Access-Control-Allow-Origin", origin)
+            self.send_header("Vary", "Origin")
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve searches over the day's article embeddings")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--days", type=int, default=1, help="Include articles added within this many days")
+    parser.add_argument("--cache-size", type=int, default=1024, help="Number of query embeddings to keep")
+    parser.add_argument("--batch-window", type=float, default=0.02, help="Seconds to wait for concurrent queries")
+    parser.add_argument("--allow-origin", action="append", default=[], metavar="ORIGIN",
+                        help="Also answer pages served from this origin, e.g. http://localhost:8000 (file:// pages are always allowed)")
+    parser.add_argument("--top-articles", type=int, default=0, help="Only search the sections of this many best matching articles (0 for all, the default)")
+    args = parser.parse_args()
+
+    ensure_articles_header()
+    print(f"Loading embeddings from the last {args.days} day(s)")
+    embedder = active_embedder()
+    RetrievalHandler.index = VectorIndex(load_recent_embeddings(n_days=args.days, version=embedder.version),
+                                         load_recent_embeddings(n_days=args.days, embeddings_file="database/summary_embeddings.csv", version=embedder.version))
+    RetrievalHandler.top_articles = args.top_articles
+    RetrievalHandler.token = retrieval_token()
+    RetrievalHandler.allowed_origins = {"null", *args.allow_origin}
+    RetrievalHandler.batcher = QueryBatcher(embedder, QueryEmbeddingCache(args.cache_size), batch_window=args.batch_window)
+
+    server = ThreadingHTTPServer((args.host, args.port), RetrievalHandler)
+    print(f"  ✓ Serving {len(RetrievalHandler.index)} sections on http://{args.host}:{args.port}/search?q=&k=")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
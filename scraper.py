@@ -5,12 +5,22 @@ import tiktoken
 from helpers import preprocess_text
 from money_stuff import scrape_money_stuff
 from the_economist import scrape_the_economist
+import argparse
 import ast
 import uuid
+from typing import Optional
 from embeddings import Embeddings
+from renderer import BriefingRenderer
+from fingerprints import FingerprintIndex, minhash_signature, DUPLICATE_THRESHOLD
+from article_store import ensure_articles_header
+from embedding_store import active_embedder, ensure_version_column, read_rows, EMBEDDINGS_HEADER
+from archive import ArchiveIndex, load_archived_article, load_archived_embedding_rows
+from profiles import load_profiles, InterestVectorCache
+from tracing import span, traced, current_span
 import csv
+import io
 import json
-from datetime import date, timedelta, datetime
+from datetime import timedelta, datetime
 
 openai.api_key = os.environ.get("OPENAI_API_KEY")
 
@@ -47,6 +57,7 @@ def num_tokens_from_messages(messages, model="gpt-3.5-turbo-0301"):
     return num_tokens
 
 
+@traced("summarize")
 def summarise_article(title, text, sentences) -> str:
     messages = [
         {"role": "system",
@@ -71,6 +82,7 @@ def summarise_article(title, text, sentences) -> str:
         temperature=0,
         max_tokens=500,
     )
+    current_span().set("tokens", response["usage"]["total_tokens"])
 
     summary_string = response['choices'][0]['message']['content']
     result_dict = ast.literal_eval(summary_string)
@@ -80,122 +92,26 @@ def summarise_article(title, text, sentences) -> str:
 
 
 # Function to generate the HTML page
-def generate_html_page(articles, styles_file="styles.css", scripts_file="scripts.js") -> str:
-    with open(styles_file, "r") as f:
-        styles = f.read()
-
-    with open(scripts_file, "r") as f:
-        scripts = f.read()
-
-    html_template = """<!DOCTYPE html>
-    <html lang="en">
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.0-alpha1/dist/css/bootstrap.min.css" rel="stylesheet">
-        <link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/bootstrap-icons@1.10.3/font/bootstrap-icons.css">
-        <title>Your Daily Briefing</title>
-        <style>
-            {styles}
-        </style>
-    </head>
-    <body>
-        <h1>Your world in brief</h1>
-        {articles_html}
-        
-        <div class="chatbot-container">
-            <button id="chatbot-button" class="btn btn-primary rounded-circle">
-                <i class="bi bi-chat-dots-fill"></i>
-            </button>
-            <div id="chatbot-box" class="card d-none">
-                <div class="card-body">
-
-
-                    <div class="chat">
-                        <div id="chatbot-messages" class="messages"></div>
-                    </div>
-
-
-                    <div id="chatbot-messages" class="mb-3"></div>
-                    <div class="input-group chatbot-input-container">
-                        <input type="text" id="chatbot-input" class="form-control" placeholder="Type your message...">
-                        <div class="input-group-append">
-                            <button id="chatbot-send" class="btn"><i class="bi bi-arrow-right-circle"></i></button>
-                        </div>
-                    </div>
-                </div>
-            </div>
-        </div>
-    </body>
-    <script>
-        const OPENAI_API_KEY = "{openai_api_key}";
-        const embeddingsData = {embeddings_data}; // in JSON format
-        {scripts}
-    </script>
-    </html>
-    """
+def generate_html_page(articles, styles_file="styles.css", scripts_file="scripts.js", embeddings_dtype="float32", embeddings_file=None, retrieval_url=None) -> str:
+    renderer = BriefingRenderer(styles_file=styles_file, scripts_file=scripts_file, embeddings_dtype=embeddings_dtype, retrieval_url=retrieval_url)
 
-    article_template = """
-        <div class="article">
-            <div class="header">
-                <div class="header-left">
-                    <img class="logo fade-in fade-in-logo" src="{logo_url}" alt="Source logo" />
-                    <div class="title-date fade-in fade-in-title-date">
-                        <a href="{url}" target="_blank"><h2>{title}</h2></a>
-                        <span class="date">{date}</span>
-                    </div>    
-                </div>
-            </div>
-            <p class="fade-in fade-in-summary">{summary}</p>
-            <p class="fade-in fade-in-opinion"><span style="color: #E3120B;">Opinion:</span> {opinion}</p>
-            </div>
-        </div>
-    """
+    # Get embeddings data to save as JSON and use in JS
+    embedder = active_embedder()
+    embeddings_data = load_recent_embeddings(n_days=1, version=embedder.version) if retrieval_url is None else []
+    summary_data = load_recent_embeddings(n_days=1, embeddings_file="database/summary_embeddings.csv", version=embedder.version) if retrieval_url is None else []
 
-    # Get list of categories from today's articles
-    categories = {}
-    for url, article in articles.items():
-        category = article["category"]
-        if category not in categories:
-            categories[category] = []
-        categories[category].append({"url": url, **article})
-
-    articles_html = ""
-
-    for category, articles_in_category in categories.items():
-        articles_html += f"""<div class='category fade-in fade-in-category'>
-            <h2>{category}</h2>
-        <hr>"""
-        for article in articles_in_category:
-            title = article["title"]
-            date = article["date"]
-            summary = article["summary"]
-            source = article["source"]
-            opinion = article["opinion"]
-            url = article["url"]
-
-            if source == "The Economist":
-                logo_path = "https://www.economist.com/engassets/google-search-logo.f1ea908894.png"
-            elif source == "Bloomberg":
-                logo_path = "https://pbs.twimg.com/profile_images/1016326195221352450/KCcdUN0v_400x400.jpg"
-            else:
-                logo_path = "http://brentapac.com/wp-content/uploads/2017/03/transparent-square.png"
-
-            formatted_date = date.strftime("%d %B %Y")
-            articles_html += article_template.format(title=title, summary=summary, url=url, logo_url=logo_path, date=formatted_date, opinion=opinion)
+    page = io.StringIO()
+    renderer.write_page(page, articles, embeddings_data, vectors_file=embeddings_file, model=embedder.embedding_model, summary_data=summary_data)
+    return page.getvalue()
 
-    # Get embeddings data to save as JSON and use in JS
-    embeddings_data = []
-    with open("database/article_embeddings.csv", "r") as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            embeddings_data.append(row)
 
-    n_days = 1  # Set the number of days you want to filter
-    article_added_dates = get_publication_dates()
-    filtered_embeddings_data = filter_embeddings_by_days(embeddings_data, article_added_dates, n_days)
+def load_recent_embeddings(n_days=1, embeddings_file="database/article_embeddings.csv", version=None) -> list:
+    """Returns the rows of the embeddings CSV for articles added within the last n days, of one embedding version
+    (the active one by default)"""
+    embeddings_data = list(read_rows(embeddings_file, version))
 
-    return html_template.format(styles=styles, scripts=scripts, embeddings_data=filtered_embeddings_data, articles_html=articles_html, openai_api_key=os.environ.get("OPENAI_API_KEY"))
+    article_added_dates = get_publication_dates()
+    return filter_embeddings_by_days(embeddings_data, article_added_dates, n_days)
 
 
 def get_publication_dates():
@@ -233,6 +149,7 @@ def filter_embeddings_by_days(embeddings_data, article_added_dates, days):
     return filtered_embeddings
 
 
+@traced("summarize_section")
 def summarise_section(text):
     messages = [
         {"role": "system",
@@ -247,14 +164,17 @@ def summarise_section(text):
         temperature=0,
         max_tokens=1000,
     )
+    current_span().set("tokens", response["usage"]["total_tokens"])
 
     summary = response['choices'][0]['message']['content']
     return summary
 
 
+@traced("recursive_summarize")
 def recursive_summarize(text_ChatML, max_tokens=3500):
     num_tokens = num_tokens_from_messages(text_ChatML)
     text = text_ChatML[-1]["content"]
+    current_span().set("input_tokens", num_tokens)
 
     if num_tokens <= max_tokens:
         return text
@@ -274,6 +194,7 @@ def recursive_summarize(text_ChatML, max_tokens=3500):
     return recursive_summarize(messages, max_tokens)
 
 
+@traced("categorize")
 def categorise_article(text: str, allowed_categories: dict) -> str:
     topics = "\n".join(allowed_categories.keys())
     messages = [
@@ -290,6 +211,7 @@ def categorise_article(text: str, allowed_categories: dict) -> str:
         temperature=0,
         max_tokens=10,
     )
+    current_span().set("tokens", response["usage"]["total_tokens"])
 
     category = response['choices'][0]['message']['content']
     return category
@@ -299,7 +221,8 @@ def preprocessing_for_gpt(article):
     text = article["article_text"]
 
     # Reduce token length of text
-    text = preprocess_text(text, stem=False, remove_stopwords=True, keep_newlines=True)
+    with span("preprocess", profile=True, characters=len(text)):
+        text = preprocess_text(text, stem=False, remove_stopwords=True, keep_newlines=True)
 
     # Remove apostrophes from the text to avoid errors with dictionary syntax
     text = text.replace("'", "\'")
@@ -368,32 +291,48 @@ def preprocessing_for_gpt(article):
     return summary, opinion, category
 
 
-if __name__ == "__main__":
-    articles = {}
+def load_stored_article(article_uuid, articles_file="database/articles.csv") -> Optional[dict]:
+    """Returns the row of a stored article, or None if it isn't in the database or the archive"""
+    with open(articles_file, "r", newline="") as f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            if row["UUID"] == str(article_uuid):
+                return row
+    return load_archived_article(article_uuid)
 
-    print("Scraping articles")
-    # Get The Economist articles
-    try:
-        print("  • Scraping The Economist...")
-        economist_articles = scrape_the_economist()
-        articles.update(economist_articles)
-    except Exception as e:
-        print(f"  ✗ Error scraping The Economist: {e}")
 
-    # Get Money Stuff articles
-    try:
-        print("  • Scraping Money Stuff by Matt Levine...")
-        latest_newsletter_text = scrape_money_stuff()
-        articles.update(latest_newsletter_text)
-    except Exception as e:
-        print(f"  ✗ Error scraping Money Stuff: {e}")
+def load_embedding_rows(article_uuids, embeddings_file, version) -> dict:
+    """Returns the saved embedding rows of one version for the given articles, as {article_uuid: [row, ...]}"""
+    rows = {}
+    if not article_uuids:
+        return rows
+    for row in read_rows(embeddings_file, version):
+        if row["article_uuid"] in article_uuids:
+            rows.setdefault(row["article_uuid"], []).append(row)
 
-    print()
-    print("Saving articles to database")
+    # Articles older than the hot window are in the archive (see archive.py)
+    archived_uuids = set(article_uuids) - set(rows)
+    if archived_uuids:
+        rows.update(load_archived_embedding_rows(archived_uuids, embeddings_file, version))
+    return rows
+
+
+def save_new_articles(articles, duplicate_threshold=DUPLICATE_THRESHOLD, on_duplicate="reuse") -> dict:
+    """Summarises and categorises the articles that aren't in the database yet, saves them, and returns them.
+
+    An article whose text is at least duplicate_threshold similar to a stored one (e.g. republished under a new URL)
+    is either saved with the stored article's summary, opinion and category (on_duplicate="reuse"), or not saved at all
+    (on_duplicate="skip").
+    """
     # Open the CSV file in read mode to check for duplicates
     with open("database/articles.csv", "r", newline="") as f:
         reader = csv.reader(f)
         existing_urls = {row[1] for row in reader}
+    existing_urls |= ArchiveIndex.load().urls
+
+    fingerprint_index = FingerprintIndex.load()
+    duplicates_reused = 0
+    duplicates_skipped = 0
 
     # Add new articles to the database
     new_articles = {}
@@ -407,29 +346,71 @@ if __name__ == "__main__":
                 print(f"    ⏭ Skipping as it already exists in the CSV")
                 continue
 
-            article_uuid = uuid.uuid4()
-            articles[url]["uuid"] = article_uuid
-            article_title = article_data["title"]
-            article_date = article_data["date"].strftime("%Y-%m-%d %H:%M:%S")
-            article_date_added = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            article_text = article_data["article_text"]
-            article_source = article_data["source"]
-
-            print(f"    • Generating summary and opinion")
-            article_summary, article_opinion, article_category = preprocessing_for_gpt(article_data)
-
-            articles[url]["summary"] = article_summary
-            articles[url]["opinion"] = article_opinion
-            articles[url]["category"] = article_category
-
-            writer.writerow([article_uuid, url, article_title, article_date, article_date_added, article_category, article_source, article_text, article_summary, article_opinion])
-            new_articles[url] = article_data
-            print(f"    ✓ Added to the CSV with UUID {article_uuid}")
-
-    print()
-    print("Generating semantic embeddings")
+            with span("article", url=url, source=article_data["source"]) as article_span:
+                # Check the text isn't a near-duplicate of a stored article
+                signature = article_data.get("fingerprint")
+                if signature is None:
+                    signature = minhash_signature(article_data["article_text"])
+                duplicate = fingerprint_index.find_duplicate(signature, duplicate_threshold)
+                stored_article = None
+                if duplicate is not None:
+                    duplicate_uuid, similarity = duplicate
+                    article_span.set("duplicate_of", duplicate_uuid)
+                    if on_duplicate == "skip":
+                        print(f"    ⏭ Skipping as it is a near-duplicate of {duplicate_uuid} ({similarity:.0%} similar)")
+                        duplicates_skipped += 1
+                        continue
+
+                    f.flush()  # The duplicate may have been saved earlier in this run
+                    stored_article = load_stored_article(duplicate_uuid)
+
+                article_uuid = uuid.uuid4()
+                articles[url]["uuid"] = article_uuid
+                article_title = article_data["title"]
+                article_date = article_data["date"].strftime("%Y-%m-%d %H:%M:%S")
+                article_date_added = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                article_text = article_data["article_text"]
+                article_source = article_data["source"]
+
+                if stored_article is not None:
+                    print(f"    • Reusing the summary and opinion of near-duplicate {duplicate_uuid} ({similarity:.0%} similar)")
+                    article_summary, article_opinion, article_category = stored_article["summary"], stored_article["opinion"], stored_article["category"]
+                    articles[url]["duplicate_of"] = duplicate_uuid
+                    duplicates_reused += 1
+                else:
+                    print(f"    • Generating summary and opinion")
+                    article_summary, article_opinion, article_category = preprocessing_for_gpt(article_data)
+
+                articles[url]["summary"] = article_summary
+                articles[url]["opinion"] = article_opinion
+                articles[url]["category"] = article_category
+
+                writer.writerow([article_uuid, url, article_title, article_date, article_date_added, article_category, article_source, article_text, article_summary, article_opinion])
+                if signature is not None:
+                    fingerprint_index.add(article_uuid, url, signature)
+                new_articles[url] = article_data
+                print(f"    ✓ Added to the CSV with UUID {article_uuid}")
+
+    if duplicates_reused or duplicates_skipped:
+        # Each one saves a summary and a categorisation completion, plus any recursive summaries of long articles
+        print(f"  ✓ Found {duplicates_reused + duplicates_skipped} near-duplicates ({duplicates_reused} reused, {duplicates_skipped} skipped), "
+              f"avoiding at least {2 * (duplicates_reused + duplicates_skipped)} completions")
+
+    return new_articles
+
+
+def save_embeddings(new_articles, embedder: Embeddings):
+    """Embeds the chunks and the summary of each new article and saves them to the embeddings CSVs.
+
+    Near-duplicates (see save_new_articles) get a copy of the stored article's embeddings instead.
+    """
+    ensure_version_column("database/article_embeddings.csv")
+    ensure_version_column("database/summary_embeddings.csv")
 
-    embedder = Embeddings()
+    duplicate_uuids = {str(article_data["duplicate_of"]) for article_data in new_articles.values() if article_data.get("duplicate_of")}
+    stored_chunk_rows = load_embedding_rows(duplicate_uuids, "database/article_embeddings.csv", embedder.version)
+    stored_summary_rows = load_embedding_rows(duplicate_uuids, "database/summary_embeddings.csv", embedder.version)
+    embedding_calls_avoided = 0
 
     # Create and open the embeddings CSV file
     with open("database/article_embeddings.csv", "a", newline="") as f:
@@ -437,47 +418,115 @@ if __name__ == "__main__":
 
         # Write the header row if the file is empty
         if f.tell() == 0:
-            writer_article.writerow(["article_uuid", "embedding_uuid", "text", "embedding"])
+            writer_article.writerow(EMBEDDINGS_HEADER)
 
         # Iterate through the new_articles dictionary
         for url, article_data in new_articles.items():
-            article_uuid = article_data["uuid"]
-            article_text = article_data["article_text"]
+            with span("article", url=url, source=article_data["source"]):
+                article_uuid = article_data["uuid"]
+                article_text = article_data["article_text"]
+                summary = article_data["summary"]
+                duplicate_uuid = article_data.get("duplicate_of")
+
+                if duplicate_uuid in stored_chunk_rows and duplicate_uuid in stored_summary_rows:
+                    # Copy the near-duplicate's embeddings rather than embedding the same text again
+                    chunk_rows = [(row["text"], row["embedding"]) for row in stored_chunk_rows[duplicate_uuid]]
+                    summary_embedding = stored_summary_rows[duplicate_uuid][0]["embedding"]
+                    embedding_calls_avoided += len(chunk_rows) + 1
+                else:
+                    # Split the article_text into chunks
+                    chunks = embedder.create_chunks(article_text, words_per_chunk=embedder.words_per_chunk, step=embedder.step)
+
+                    # Generate embeddings for each chunk
+                    chunk_rows = []
+                    for chunk in chunks:
+                        chunk_text = " ".join(chunk)
+                        chunk_rows.append((chunk_text, embedder.len_safe_get_embedding(chunk_text, average=True)))
+
+                    # Embed the summary
+                    summary_embedding = embedder.len_safe_get_embedding(summary, average=True)
+
+                # Save the embeddings in the CSV file
+                for i, (chunk_text, chunk_embedding) in enumerate(chunk_rows):
+                    embeddings_uuid = f"{article_uuid}_embedding-{i}"
+                    writer_article.writerow([article_uuid, embeddings_uuid, chunk_text, chunk_embedding, embedder.version])
+                summary_uuid = f"{article_uuid}_embedding-summary"
 
-            # Split the article_text into chunks
-            chunks = embedder.create_chunks(article_text, words_per_chunk=100, step=10)
+                # Keep them for near-duplicates later in this run
+                if str(article_uuid) in duplicate_uuids:
+                    stored_chunk_rows[str(article_uuid)] = [{"text": chunk_text, "embedding": chunk_embedding} for chunk_text, chunk_embedding in chunk_rows]
+                    stored_summary_rows[str(article_uuid)] = [{"text": summary, "embedding": summary_embedding}]
 
-            # Generate embeddings for each chunk
-            for i, chunk in enumerate(chunks):
-                embeddings_uuid = f"{article_uuid}_embedding-{i}"
-                chunk_text = " ".join(chunk)
-                chunk_embedding = embedder.len_safe_get_embedding(chunk_text, average=True)
+                # Open the summary embeddings CSV file in append mode
+                with open("database/summary_embeddings.csv", "a", newline="") as s:
+                    writer_summary = csv.writer(s)
 
-                # Save the embeddings in the CSV file
-                writer_article.writerow([article_uuid, embeddings_uuid, chunk_text, chunk_embedding])
+                    # Write the header row if the file is empty
+                    if s.tell() == 0:
+                        writer_summary.writerow(EMBEDDINGS_HEADER)
 
-            # Embed the summary
-            summary = article_data["summary"]
-            summary_embedding = embedder.len_safe_get_embedding(summary, average=True)
-            summary_uuid = f"{article_uuid}_embedding-summary"
+                    # Save the summary embeddings in the CSV file
+                    writer_summary.writerow([article_uuid, summary_uuid, summary, summary_embedding, embedder.version])
+
+                print(f"  ✓ Generated embeddings for {url} and saved to the CSV")
+
+    if embedding_calls_avoided:
+        print(f"  ✓ Copied the embeddings of near-duplicates, avoiding {embedding_calls_avoided} embedding calls")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scrape, summarise and embed today's articles, and render the briefings")
+    parser.add_argument("--retrieval-url", help="Have the pages ask retrieval_server.py at this URL for related sections, e.g. http://localhost:8765")
+    parser.add_argument("--sidecar-embeddings", action="store_true",
+                        help="Write each day's vectors to a file next to the page, loaded on the first question (the pages must be served over HTTP)")
+    parser.add_argument("--embeddings-dtype", choices=["float32", "float16"], default="float32", help="Precision of the vectors in the pages")
+    parser.add_argument("--duplicate-threshold", type=float, default=DUPLICATE_THRESHOLD,
+                        help="Estimated share of shingles two articles must have in common to count as near-duplicates")
+    parser.add_argument("--on-duplicate", choices=["reuse", "skip"], default="reuse",
+                        help="Save near-duplicates with the stored article's summary and embeddings, or don't save them at all")
+    args = parser.parse_args()
+
+    ensure_articles_header()  # Installs from before the date_added and category columns were named
+    articles = {}
+
+    print("Scraping articles")
+    # Get The Economist articles
+    try:
+        print("  • Scraping The Economist...")
+        with span("scrape", source="The Economist"):
+            economist_articles = scrape_the_economist()
+        articles.update(economist_articles)
+    except Exception as e:
+        print(f"  ✗ Error scraping The Economist: {e}")
 
-            # Open the summary embeddings CSV file in append mode
-            with open("database/summary_embeddings.csv", "a", newline="") as s:
-                writer_summary = csv.writer(s)
+    # Get Money Stuff articles
+    try:
+        print("  • Scraping Money Stuff by Matt Levine...")
+        with span("scrape", source="Bloomberg"):
+            latest_newsletter_text = scrape_money_stuff()
+        articles.update(latest_newsletter_text)
+    except Exception as e:
+        print(f"  ✗ Error scraping Money Stuff: {e}")
 
-                # Write the header row if the file is empty
-                if s.tell() == 0:
-                    writer_summary.writerow(["article_uuid", "embedding_uuid", "text", "embedding"])
+    print()
+    print("Saving articles to database")
+    new_articles = save_new_articles(articles, duplicate_threshold=args.duplicate_threshold, on_duplicate=args.on_duplicate)
 
-                # Save the summary embeddings in the CSV file
-                writer_summary.writerow([article_uuid, summary_uuid, summary, summary_embedding])
+    print()
+    print("Generating semantic embeddings")
 
-            print(f"  ✓ Generated embeddings for {url} and saved to the CSV")
+    embedder = active_embedder()  # See reembed.py to switch to another model
+    save_embeddings(new_articles, embedder)
 
     print()
-    print("Generating HTML page")
-    # Save the HTML page to a file
-    today = date.today().strftime("%Y-%m-%d")
-    with open(f"briefings/your_world_in_brief_{today}.html", "w") as file:
-        html_page = generate_html_page(new_articles)
-        file.write(html_page)
+    print("Generating HTML pages")
+    # Each profile in profiles.json also gets its own page, ranked from the same summaries and embeddings
+    profiles = load_profiles()
+    interest_vectors = InterestVectorCache().interest_vectors(profiles, embedder) if profiles else {}
+
+    # Re-render every day whose articles changed, with all of that day's articles, and update the archive index
+    renderer = BriefingRenderer(embeddings_dtype=args.embeddings_dtype, sidecar_embeddings=args.sidecar_embeddings, retrieval_url=args.retrieval_url)
+    for day in renderer.render_changed_days(profiles=profiles, interest_vectors=interest_vectors):
+        print(f"  ✓ Saved briefings/{renderer.briefing_filename(day)}")
+        for profile in profiles:
+            print(f"  ✓ Saved briefings/{renderer.briefing_filename(day, profile['name'])}")
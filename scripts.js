@@ -32,15 +32,26 @@ const messages = [];
 const messagesWithContext = [];
 messages.push({ role: "system", content: "You are a chatbot on a page which shows summarise of news articles. Your job is to answer questions that the user has about the articles. You will be given sections from the article which may be related to help you answer their question." });
 
-// Convert embeddings to JSON
-let embeddings;
-(async () => {
-  embeddings = await getEmbeddings();
-})();
+// Decode the embeddings lazily, on the first question, so they don't slow down the page load
+let embeddingsPromise = null;
+function loadEmbeddings() {
+    if (embeddingsPromise === null) {
+        embeddingsPromise = getEmbeddings();
+    }
+    return embeddingsPromise;
+}
 
 async function getAssistantResponse(userMessage) {
-    const searchTermVector = await getSearchTermVector(userMessage); // Turn the user's question into a searchTermVector.
-    const topResults = getTopNResults(embeddings, searchTermVector, 5); // Get the top N related article sections using the searchTermVector.
+    const searchStart = performance.now();
+    let topResults;
+    if (RETRIEVAL_URL !== null) {
+        topResults = await getRetrievalServerResults(userMessage, 5); // The retrieval server embeds the question and searches the day's index.
+    } else {
+        // Turn the user's question into a searchTermVector while the embeddings are decoded.
+        const [embeddings, searchTermVector] = await Promise.all([loadEmbeddings(), getSearchTermVector(userMessage)]);
+        topResults = getTopNResults(embeddings, searchTermVector, 5); // Get the top N related article sections using the searchTermVector.
+    }
+    console.log(`Found related sections in ${(performance.now() - searchStart).toFixed(1)} ms`);
 
     // Append the related sections as context to the user's message.
     const relatedSections = topResults.join("\n\n- ");
@@ -124,7 +135,9 @@ document.addEventListener("DOMContentLoaded", function() {
             chatbotMessages.scrollTop = chatbotMessages.scrollHeight;
             chatbotBox.scrollTop = chatbotBox.scrollHeight;
 
+            const answerStart = performance.now();
             const assistantMessage = await getAssistantResponse(userMessage);
+            console.log(`Answered in ${(performance.now() - answerStart).toFixed(1)} ms`);
 
             // Remove typing dots
             const typingDots = document.getElementById("typing-dots");
@@ -143,42 +156,91 @@ document.addEventListener("DOMContentLoaded", function() {
 
 
 // Embeddings
-function pythonListToJSONArray(pythonListString) {
-  const jsonString = pythonListString
-    .replace(/'/g, `"`)
-    .replace(/None/g, "null")
-    .replace(/True/g, "true")
-    .replace(/False/g, "false");
-  return JSON.parse(jsonString);
+// The page carries the normalised vectors as one little-endian float32 (or float16) blob, row by row,
+// either inline as base64 or in a sidecar file next to the page. See build_embeddings_index() in renderer.py.
+function base64ToBytes(base64) {
+  const binary = atob(base64);
+  const bytes = new Uint8Array(binary.length);
+  for (let i = 0; i < binary.length; i++) {
+    bytes[i] = binary.charCodeAt(i);
+  }
+  return bytes;
 }
 
-function dotProduct(a, b) {
-  let sum = 0;
-  for (let i = 0; i < a.length; i++) {
-    sum += a[i] * b[i];
+let float16Table = null;
+function float16ToFloat32(halves) {
+  // Decode every possible half-precision value once, then look each one up
+  if (float16Table === null) {
+    float16Table = new Float32Array(65536);
+    for (let h = 0; h < 65536; h++) {
+      const sign = (h & 0x8000) ? -1 : 1;
+      const exponent = (h >> 10) & 0x1f;
+      const fraction = h & 0x03ff;
+      if (exponent === 0) {
+        float16Table[h] = sign * Math.pow(2, -14) * (fraction / 1024);
+      } else if (exponent === 0x1f) {
+        float16Table[h] = fraction ? NaN : sign * Infinity;
+      } else {
+        float16Table[h] = sign * Math.pow(2, exponent - 15) * (1 + fraction / 1024);
+      }
+    }
   }
-  return sum;
+
+  const floats = new Float32Array(halves.length);
+  for (let i = 0; i < halves.length; i++) {
+    floats[i] = float16Table[halves[i]];
+  }
+  return floats;
 }
 
-function magnitude(a) {
+function normalise(vector) {
   let sum = 0;
-  for (let i = 0; i < a.length; i++) {
-    sum += a[i] * a[i];
+  for (let i = 0; i < vector.length; i++) {
+    sum += vector[i] * vector[i];
   }
-  return Math.sqrt(sum);
+  const norm = Math.sqrt(sum) || 1;
+  for (let i = 0; i < vector.length; i++) {
+    vector[i] /= norm;
+  }
+  return vector;
 }
 
-function cosineSimilarity(a, b) {
-  return dotProduct(a, b) / (magnitude(a) * magnitude(b));
+// Dot product of the query with the row of the vectors matrix starting at offset
+function dotProduct(vectors, offset, query) {
+  let sum = 0;
+  for (let i = 0; i < query.length; i++) {
+    sum += vectors[offset + i] * query[i];
+  }
+  return sum;
 }
 
 async function getEmbeddings() {
-    return embeddingsData.map((row) => ({
-        article_uuid: row.article_uuid,
-        embedding_uuid: row.embedding_uuid,
-        text: row.text,
-        embedding: pythonListToJSONArray(row.embedding),
-    }));
+    const decodeStart = performance.now();
+    let bytes;
+    if (embeddingsIndex.vectors !== null) {
+        bytes = base64ToBytes(embeddingsIndex.vectors);
+    } else {
+        const response = await fetch(embeddingsIndex.vectors_url);
+        bytes = new Uint8Array(await response.arrayBuffer());
+    }
+
+    let vectors;
+    if (embeddingsIndex.dtype === "float16") {
+        vectors = float16ToFloat32(new Uint16Array(bytes.buffer, bytes.byteOffset, bytes.length / 2));
+    } else {
+        vectors = new Float32Array(bytes.buffer, bytes.byteOffset, bytes.length / 4);
+    }
+    console.log(`Decoded ${embeddingsIndex.count} embeddings (${bytes.length} bytes) in ${(performance.now() - decodeStart).toFixed(1)} ms`);
+
+    return {
+        count: embeddingsIndex.count,
+        dims: embeddingsIndex.dims,
+        articleUuids: embeddingsIndex.article_uuids,
+        texts: embeddingsIndex.texts,
+        articleCount: embeddingsIndex.article_count,
+        articleStarts: embeddingsIndex.article_starts,
+        vectors: vectors, // The chunk rows, then one row per article
+    };
 }
 
 async function getSearchTermVector(searchTerm) {
@@ -190,7 +252,7 @@ async function getSearchTermVector(searchTerm) {
     },
     body: JSON.stringify({
       input: searchTerm,
-      model: "text-embedding-ada-002",
+      model: embeddingsIndex.model,
     }),
   });
 
@@ -199,18 +261,59 @@ async function getSearchTermVector(searchTerm) {
 }
 
 
-function getTopNResults(embeddings, searchTermVector, n) {
-    embeddings.forEach((row) => {
-        row.similarity = cosineSimilarity(row.embedding, searchTermVector);
-    });
+// Set above 0 to only score the chunks of the TOP_ARTICLES articles most similar to the question. That is faster over
+// long histories but can miss a section of a less similar article (see benchmarks/retrieval.py); 0 scores every chunk.
+const TOP_ARTICLES = 0;
+
+// Partial top-n: keeps the best n ids seen so far in top, sorted by descending score
+function pushTopN(top, n, score, id) {
+    if (top.scores.length === n && score <= top.scores[n - 1]) {
+        return;
+    }
+
+    let i = top.scores.length === n ? n - 1 : top.scores.length;
+    while (i > 0 && top.scores[i - 1] < score) {
+        top.scores[i] = top.scores[i - 1];
+        top.ids[i] = top.ids[i - 1];
+        i--;
+    }
+    top.scores[i] = score;
+    top.ids[i] = id;
+}
+
+function getTopNResults(embeddings, searchTermVector, n, topArticles = TOP_ARTICLES) {
+    const { count, dims, vectors, texts, articleCount, articleStarts } = embeddings;
+    const query = normalise(Float32Array.from(searchTermVector));
+
+    // Rank the articles by their summary (or chunk centroid) vectors, stored after the chunk rows
+    let ranges = [[0, count]];
+    if (topArticles > 0 && articleCount > topArticles) {
+        const topArticleIds = { scores: [], ids: [] };
+        for (let article = 0; article < articleCount; article++) {
+            pushTopN(topArticleIds, topArticles, dotProduct(vectors, (count + article) * dims, query), article);
+        }
+        ranges = topArticleIds.ids.map((article) => [articleStarts[article], articleStarts[article + 1]]);
+    }
+
+    const topRows = { scores: [], ids: [] };
+    for (const [start, end] of ranges) {
+        for (let row = start; row < end; row++) {
+            pushTopN(topRows, n, dotProduct(vectors, row * dims, query), row); // Both vectors have unit length, so this is the cosine similarity
+        }
+    }
+
+    return topRows.ids.map((row) => texts[row]);
+}
 
-  embeddings.sort((a, b) => b.similarity - a.similarity);
-  return embeddings.slice(0, n).map((row) => row.text);
+async function getRetrievalServerResults(searchTerm, n) {
+    const response = await fetch(`${RETRIEVAL_URL}/search?q=${encodeURIComponent(searchTerm)}&k=${n}&token=${RETRIEVAL_TOKEN}`);
+    const data = await response.json();
+    return data.results.map((result) => result.text);
 }
 
 // Usage:
 /*
-getEmbeddings().then(async (embeddings) => {
+loadEmbeddings().then(async (embeddings) => {
   const searchTerm = "Credit Suisse and liabilities";
   const searchTermVector = await getSearchTermVector(searchTerm);
   const topResults = getTopNResults(embeddings, searchTermVector, 5);
@@ -4,19 +4,24 @@ from datetime import datetime
 from secrets import username, password
 import csv
 from readability import Document
+from tracing import span
+from fingerprints import minhash_signature
 
 
 def login_to_economist(username, password):
     login_url = "https://myaccount.economist.com/s/login"
     payload = {"username": username, "password": password}
     session = requests.Session()
-    session.post(login_url, data=payload)
+    with span("login", url=login_url):
+        session.post(login_url, data=payload)
     return session
 
 
 def scrape_homepage(session, homepage_url) -> BeautifulSoup:
-    response = session.get(homepage_url)
-    soup = BeautifulSoup(response.text, "html.parser")
+    with span("fetch", url=homepage_url):
+        response = session.get(homepage_url)
+    with span("parse", url=homepage_url):
+        soup = BeautifulSoup(response.text, "html.parser")
     return soup
 
 
@@ -56,8 +61,11 @@ def get_articles(soup, session, homepage_url) -> dict:
             continue
 
         # Fetch the article content
-        article_response = session.get(url)
-        article_soup = BeautifulSoup(article_response.text, "html.parser")
+        with span("fetch", url=url) as fetch_span:
+            article_response = session.get(url)
+            fetch_span.set("bytes", len(article_response.text))
+        with span("parse", profile=True, url=url):
+            article_soup = BeautifulSoup(article_response.text, "html.parser")
 
         # Extract the article's publication date
         try:
@@ -71,10 +79,11 @@ def get_articles(soup, session, homepage_url) -> dict:
         print(f"    • Scraping '{title}' ({article_datetime}, {url})")
 
         # Get the article text/HTML for reader view
-        html_content = article_response.text
-        doc = Document(html_content)
-        article_text = doc.summary()
-        article_text = BeautifulSoup(article_text, "html.parser").get_text()  # Remove HTML tags from text
+        with span("readability", profile=True, url=url):
+            html_content = article_response.text
+            doc = Document(html_content)
+            article_text = doc.summary()
+            article_text = BeautifulSoup(article_text, "html.parser").get_text()  # Remove HTML tags from text
 
         if article_datetime is not None and article_text is not None:  # if current_time - article_datetime < timedelta(hours=48):
             # Save to dictionary
@@ -82,7 +91,8 @@ def get_articles(soup, session, homepage_url) -> dict:
                 "title": title,
                 "date": article_datetime,
                 "article_text": article_text,
-                "source": "The Economist"
+                "source": "The Economist",
+                "fingerprint": minhash_signature(article_text),
             }
 
     return articles
@@ -0,0 +1,245 @@
+"""
+Span-based tracing for the briefing pipeline.
+
+Tracing is off unless the BRIEFING_TRACE environment variable is set to an output path, e.g.
+
+    BRIEFING_TRACE=traces/run.json python scraper.py
+
+When it is on, every span (fetch, parse, preprocess, summarize, categorize, embed, render, ...) is recorded with its
+attributes, and at exit two files are written: the Chrome trace-event JSON at that path (open it in chrome://tracing or
+https://ui.perfetto.dev) and the spans as collapsed stacks in <path>.folded (for flamegraph.pl or speedscope). Setting
+BRIEFING_PROFILE to a sampling interval in milliseconds also samples the Python stack of spans opened with
+profile=True, and writes the samples as collapsed stacks to <path>.profile.folded.
+
+When tracing is off, functions decorated with @traced call straight through and span() returns a shared no-op span, so
+the instrumentation costs nothing beyond one global check per call. The check happens at call time, so enable() also
+traces functions that were decorated before it was called.
+"""
+import atexit
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from typing import Dict, List, Optional
+
+
+class Span:
+    def __init__(self, tracer: "Tracer", name: str, attributes: dict, profile: bool):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.profile = profile
+        self.thread_id = threading.get_ident()
+        self.parent: Optional[Span] = None
+        self.path = name
+        self.start = 0
+        self.end = 0
+        self.child_time = 0
+
+    def set(self, key: str, value):
+        self.attributes[key] = value
+
+    def add(self, key: str, n=1):
+        self.attributes[key] = self.attributes.get(key, 0) + n
+
+    def __enter__(self):
+        stack = self.tracer.stack()
+        if stack:
+            self.parent = stack[-1]
+            self.path = f"{self.parent.path};{self.name}"
+        stack.append(self)
+        if self.profile and self.tracer.profiler is not None:
+            self.tracer.profiler.watch(self.thread_id, self.path)
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.end = time.perf_counter_ns()
+        if exc_type is not None:
+            self.attributes["error"] = f"{exc_type.__name__}: {exc}"
+        stack = self.tracer.stack()
+        stack.pop()
+        if self.profile and self.tracer.profiler is not None:
+            self.tracer.profiler.unwatch(self.thread_id, self.parent.path if self.parent is not None and self.parent.profile else None)
+        if self.parent is not None:
+            self.parent.child_time += self.end - self.start
+        self.tracer.record(self)
+        return False
+
+
+class NoopSpan:
+    def set(self, key: str, value):
+        pass
+
+    def add(self, key: str, n=1):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+
+NOOP_SPAN = NoopSpan()
+
+
+class SamplingProfiler:
+    """Samples the Python stack of threads inside a profiled span every interval seconds"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.watched: Dict[int, str] = {}  # Thread id -> path of the innermost profiled span
+        self.samples: Dict[str, int] = {}
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def watch(self, thread_id: int, path: str):
+        with self.lock:
+            self.watched[thread_id] = path
+
+    def unwatch(self, thread_id: int, parent_path: Optional[str]):
+        with self.lock:
+            if parent_path is None:
+                self.watched.pop(thread_id, None)
+            else:
+                self.watched[thread_id] = parent_path
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                watched = dict(self.watched)
+            if not watched:
+                continue
+
+            frames = sys._current_frames()
+            for thread_id, path in watched.items():
+                frame = frames.get(thread_id)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                key = ";".join([path] + stack[::-1])
+                with self.lock:
+                    self.samples[key] = self.samples.get(key, 0) + 1
+
+
+class Tracer:
+    def __init__(self, output_file: str, profile_interval: Optional[float] = None):
+        self.output_file = output_file
+        self.spans: List[Span] = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.origin = time.perf_counter_ns()
+        self.profiler = SamplingProfiler(profile_interval) if profile_interval else None
+
+    def stack(self) -> List[Span]:
+        if not hasattr(self.local, "stack"):
+            self.local.stack = []
+        return self.local.stack
+
+    def record(self, span: Span):
+        with self.lock:
+            self.spans.append(span)
+
+    def chrome_trace(self) -> dict:
+        pid = os.getpid()
+        events = []
+        for span in self.spans:
+            events.append({
+                "name": span.name,
+                "cat": "briefing",
+                "ph": "X",
+                "ts": (span.start - self.origin) / 1000,
+                "dur": (span.end - span.start) / 1000,
+                "pid": pid,
+                "tid": span.thread_id,
+                "args": {key: value if isinstance(value, (int, float, bool)) else str(value) for key, value in span.attributes.items()},
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def collapsed_stacks(self) -> Dict[str, int]:
+        """Returns the self time of each span path in microseconds"""
+        stacks = {}
+        for span in self.spans:
+            self_time = (span.end - span.start - span.child_time) // 1000
+            stacks[span.path] = stacks.get(span.path, 0) + max(self_time, 0)
+        return stacks
+
+    def export(self):
+        directory = os.path.dirname(self.output_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with open(self.output_file, "w") as f:
+            json.dump(self.chrome_trace(), f)
+
+        write_collapsed(self.output_file + ".folded", self.collapsed_stacks())
+        if self.profiler is not None:
+            with self.profiler.lock:
+                samples = dict(self.profiler.samples)
+            write_collapsed(self.output_file + ".profile.folded", samples)
+
+        print(f"Saved trace of {len(self.spans)} spans to {self.output_file}")
+
+
+def write_collapsed(path: str, stacks: Dict[str, int]):
+    with open(path, "w") as f:
+        for stack, value in sorted(stacks.items()):
+            f.write(f"{stack} {value}\n")
+
+
+_tracer: Optional[Tracer] = None
+
+
+def enable(output_file: str, profile_interval: Optional[float] = None) -> Tracer:
+    """Starts recording spans, and writes them to output_file at exit"""
+    global _tracer
+    _tracer = Tracer(output_file, profile_interval)
+    atexit.register(_tracer.export)
+    return _tracer
+
+
+def span(name: str, profile: bool = False, **attributes):
+    """Returns a context manager timing a span, e.g. `with span("fetch", url=url) as s: ...; s.set("bytes", n)`.
+
+    profile=True marks a CPU-heavy span for the sampling profiler.
+    """
+    if _tracer is None:
+        return NOOP_SPAN
+    return Span(_tracer, name, attributes, profile)
+
+
+def current_span():
+    if _tracer is None:
+        return NOOP_SPAN
+    stack = _tracer.stack()
+    return stack[-1] if stack else NOOP_SPAN
+
+
+def record_retry(retry_state):
+    """A tenacity before_sleep callback, counting retries on the current span"""
+    current_span().add("retries")
+
+
+def traced(name: str, profile: bool = False):
+    """Decorates a function to run inside a span whenever tracing is on"""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return function(*args, **kwargs)
+            with span(name, profile=profile):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+if os.environ.get("BRIEFING_TRACE"):
+    profile_interval = os.environ.get("BRIEFING_PROFILE")
+    enable(os.environ["BRIEFING_TRACE"], float(profile_interval) / 1000 if profile_interval else None)